@@ -13,17 +13,25 @@ Date: 2025-05-25
 
 import os
 import json
+import asyncio
+import functools
+import orjson
 from typing import List, Optional, Dict, Any, Union
 from fastapi import APIRouter, File, Form, UploadFile, HTTPException, Body
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel, Field
-import base64
-from io import BytesIO
 from PIL import Image
 import numpy as np
+import cv2
 
 # 导入 Moondream 推理模块
 from app.cv.inference.moondream.moondream import MoondreamInference
+from app.utils.tools import (
+    read_pil_imagefile_async,
+    encode_pil_image_to_base64,
+    encode_bgr_image_to_base64,
+    normalize_image_format,
+)
 
 # 创建路由器
 router = APIRouter(
@@ -33,16 +41,90 @@ router = APIRouter(
 
 # 全局模型实例
 _model_instance = None
-
-
-def get_model_instance(compile: bool = False) -> MoondreamInference:
-    """获取或创建模型实例（单例模式）"""
+_model_init_lock = asyncio.Lock()
+# 串行化对共享模型实例的推理调用：生成过程共享模型内部状态，不能在多个线程中并发执行
+_model_call_lock = asyncio.Lock()
+
+
+async def get_model_instance(compile: bool = False) -> MoondreamInference:
+    """
+    获取或创建模型实例（单例模式）
+    
+    使用双重检查加锁，避免冷启动时并发请求重复加载模型；
+    模型在线程池中构建，加载期间不阻塞事件循环。实例来自 MoondreamInference.get_shared()，
+    与进程内其他调用方共享。
+    """
     global _model_instance
-    if _model_instance is None:
-        _model_instance = MoondreamInference(compile=compile)
+    if _model_instance is not None:
+        return _model_instance
+    async with _model_init_lock:
+        if _model_instance is None:
+            _model_instance = await asyncio.to_thread(MoondreamInference.get_shared, compile=compile)
     return _model_instance
 
 
+async def _run_inference(func, *args):
+    """
+    在线程池中运行一次模型推理
+    
+    生成可能持续数秒，直接在 async 处理函数中调用会阻塞事件循环，使其他请求和
+    YOLOE 微批窗口一起停顿。调用按 _model_call_lock 串行执行，等待中的请求只占用协程，
+    不占用线程池中的线程。
+    """
+    async with _model_call_lock:
+        return await asyncio.to_thread(func, *args)
+
+
+def _resolve_image_format(image_format: str) -> str:
+    """校验返回图像格式（jpeg/png/webp），非法时返回 400"""
+    try:
+        return normalize_image_format(image_format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _annotate_ground(image: Image.Image, bboxes: List[List[float]], label: str,
+                     image_format: str = "jpeg") -> str:
+    """在图像上绘制边界框并编码为 base64"""
+    # np.asarray 直接复用 PIL 缓冲区（零拷贝，只读），cvtColor 生成唯一一份可写的 BGR 副本
+    img_array = cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2BGR)
+
+    if len(bboxes) == 0:
+        return encode_bgr_image_to_base64(img_array, image_format)
+
+    # 一次性转换所有边界框为 (N, 4, 2) 顶点数组，单次 polylines 调用绘制全部矩形
+    boxes = np.asarray(bboxes, dtype=np.float64).astype(np.int32).reshape(-1, 4)
+    x1, y1, x2, y2 = boxes.T
+    corners = np.stack([
+        np.stack([x1, y1], axis=1),
+        np.stack([x2, y1], axis=1),
+        np.stack([x2, y2], axis=1),
+        np.stack([x1, y2], axis=1),
+    ], axis=1)
+    cv2.polylines(img_array, corners, isClosed=True, color=(0, 255, 0), thickness=2)
+
+    # 标签文字相同，只需逐框放置
+    for left, top in zip(x1.tolist(), y1.tolist()):
+        cv2.putText(img_array, label, (left, top - 10),
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+
+    # 直接以 OpenCV 编码，无需再转换回 PIL
+    return encode_bgr_image_to_base64(img_array, image_format)
+
+
+def _annotate_point(image: Image.Image, x: int, y: int, image_format: str = "jpeg") -> str:
+    """在图像上标记点击位置并编码为 base64"""
+    # np.asarray 直接复用 PIL 缓冲区（零拷贝，只读），cvtColor 生成唯一一份可写的 BGR 副本
+    img_array = cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2BGR)
+
+    # 绘制点击位置（BGR 红色）
+    cv2.circle(img_array, (x, y), 5, (0, 0, 255), -1)
+    cv2.circle(img_array, (x, y), 10, (0, 0, 255), 2)
+
+    # 直接以 OpenCV 编码，无需再转换回 PIL
+    return encode_bgr_image_to_base64(img_array, image_format)
+
+
 # Pydantic 模型定义
 class PointRequest(BaseModel):
     """点击查询请求模型"""
@@ -60,6 +142,7 @@ class PointRequest(BaseModel):
 - file: 要描述的图像文件
 - compile: 是否编译模型以加速推理（首次会较慢）
 - return_image: 是否返回标注后的图像（base64编码）
+- image_format: 返回图像的编码格式（jpeg / png / webp，默认 jpeg）
 
 **返回格式：**
 ```json
@@ -72,28 +155,26 @@ class PointRequest(BaseModel):
 async def describe_image(
     file: UploadFile = File(..., description="要描述的图像文件"),
     compile: bool = Form(default=False, description="是否编译模型"),
-    return_image: bool = Form(default=False, description="是否返回标注图像")
+    return_image: bool = Form(default=False, description="是否返回标注图像"),
+    image_format: str = Form(default="jpeg", description="返回图像格式：jpeg / png / webp")
 ):
     """生成图像的详细描述"""
+    image_format = _resolve_image_format(image_format)
     try:
-        # 读取图像
-        contents = await file.read()
-        image = Image.open(BytesIO(contents)).convert("RGB")
+        # 读取图像（在线程池中解码，避免阻塞事件循环）
+        image = await read_pil_imagefile_async(file)
         
         # 获取模型实例
-        model = get_model_instance(compile=compile)
+        model = await get_model_instance(compile=compile)
         
         # 执行描述
-        result = model.describe(image)
+        result = await _run_inference(model.describe, image)
         
         # 如果需要返回图像，将原图编码为 base64
         if return_image:
-            buffered = BytesIO()
-            image.save(buffered, format="PNG")
-            img_str = base64.b64encode(buffered.getvalue()).decode()
-            result["annotated_image"] = img_str
+            result["annotated_image"] = await asyncio.to_thread(encode_pil_image_to_base64, image, image_format)
         
-        return JSONResponse(content=result)
+        return ORJSONResponse(content=result)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"推理失败: {str(e)}")
@@ -109,6 +190,7 @@ async def describe_image(
 - object_name: 要定位的对象名称（如 "person", "car" 等）
 - compile: 是否编译模型
 - return_image: 是否返回标注后的图像
+- image_format: 返回图像的编码格式（jpeg / png / webp，默认 jpeg）
 
 **返回格式：**
 ```json
@@ -124,45 +206,45 @@ async def ground_object(
     file: UploadFile = File(..., description="要分析的图像文件"),
     object_name: str = Form(..., description="要定位的对象名称"),
     compile: bool = Form(default=False, description="是否编译模型"),
-    return_image: bool = Form(default=False, description="是否返回标注图像")
+    return_image: bool = Form(default=False, description="是否返回标注图像"),
+    image_format: str = Form(default="jpeg", description="返回图像格式：jpeg / png / webp")
 ):
     """在图像中定位指定对象"""
+    image_format = _resolve_image_format(image_format)
     try:
-        # 读取图像
-        contents = await file.read()
-        image = Image.open(BytesIO(contents)).convert("RGB")
+        # 读取图像（在线程池中解码，避免阻塞事件循环）
+        image = await read_pil_imagefile_async(file)
         
         # 获取模型实例
-        model = get_model_instance(compile=compile)
+        model = await get_model_instance(compile=compile)
         
         # 执行定位
-        result = model.ground(image, object_name)
+        result = await _run_inference(model.ground, image, object_name)
         
         # 如果需要返回图像，绘制边界框
         if return_image:
-            import cv2
-            img_array = np.array(image)
-            
-            # 绘制边界框
-            for bbox in result["bboxes"]:
-                x1, y1, x2, y2 = [int(coord) for coord in bbox]
-                cv2.rectangle(img_array, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                cv2.putText(img_array, object_name, (x1, y1-10), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-            
-            # 转换回 PIL 并编码
-            annotated_image = Image.fromarray(img_array)
-            buffered = BytesIO()
-            annotated_image.save(buffered, format="PNG")
-            img_str = base64.b64encode(buffered.getvalue()).decode()
-            result["annotated_image"] = img_str
+            result["annotated_image"] = await asyncio.to_thread(
+                _annotate_ground, image, result["bboxes"], object_name, image_format
+            )
         
-        return JSONResponse(content=result)
+        return ORJSONResponse(content=result)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"推理失败: {str(e)}")
 
 
+@functools.lru_cache(maxsize=128)
+def _parse_point_data(point_data: str):
+    """
+    解析点击数据 JSON，返回 (x, y, question)
+
+    使用 orjson 解析；结果为不可变元组，相同的请求字符串直接命中缓存。
+    orjson.JSONDecodeError 是 json.JSONDecodeError 的子类，调用方的异常处理不变。
+    """
+    data = orjson.loads(point_data)
+    return data["x"], data["y"], data["question"]
+
+
 @router.post("/point", summary="点击查询", description="""
 基于用户点击的位置回答问题。
 
@@ -173,6 +255,7 @@ async def ground_object(
 - point_data: 包含点击坐标和问题的 JSON 数据
 - compile: 是否编译模型
 - return_image: 是否返回标注后的图像（会标记点击位置）
+- image_format: 返回图像的编码格式（jpeg / png / webp，默认 jpeg）
 
 **请求体示例：**
 ```json
@@ -197,46 +280,32 @@ async def point_query(
     file: UploadFile = File(..., description="要分析的图像文件"),
     point_data: str = Form(..., description="点击数据 JSON"),
     compile: bool = Form(default=False, description="是否编译模型"),
-    return_image: bool = Form(default=False, description="是否返回标注图像")
+    return_image: bool = Form(default=False, description="是否返回标注图像"),
+    image_format: str = Form(default="jpeg", description="返回图像格式：jpeg / png / webp")
 ):
     """基于点击位置回答问题"""
+    image_format = _resolve_image_format(image_format)
     try:
         # 解析点击数据
         try:
-            data = json.loads(point_data)
-            x = data["x"]
-            y = data["y"]
-            question = data["question"]
+            x, y, question = _parse_point_data(point_data)
         except (json.JSONDecodeError, KeyError) as e:
             raise HTTPException(status_code=400, detail=f"无效的点击数据: {str(e)}")
         
-        # 读取图像
-        contents = await file.read()
-        image = Image.open(BytesIO(contents)).convert("RGB")
+        # 读取图像（在线程池中解码，避免阻塞事件循环）
+        image = await read_pil_imagefile_async(file)
         
         # 获取模型实例
-        model = get_model_instance(compile=compile)
+        model = await get_model_instance(compile=compile)
         
         # 执行点击查询
-        result = model.point(image, (x, y), question)
+        result = await _run_inference(model.point, image, (x, y), question)
         
         # 如果需要返回图像，标记点击位置
         if return_image:
-            import cv2
-            img_array = np.array(image)
-            
-            # 绘制点击位置
-            cv2.circle(img_array, (x, y), 5, (255, 0, 0), -1)
-            cv2.circle(img_array, (x, y), 10, (255, 0, 0), 2)
-            
-            # 转换回 PIL 并编码
-            annotated_image = Image.fromarray(img_array)
-            buffered = BytesIO()
-            annotated_image.save(buffered, format="PNG")
-            img_str = base64.b64encode(buffered.getvalue()).decode()
-            result["annotated_image"] = img_str
+            result["annotated_image"] = await asyncio.to_thread(_annotate_point, image, x, y, image_format)
         
-        return JSONResponse(content=result)
+        return ORJSONResponse(content=result)
         
     except HTTPException:
         raise
@@ -254,6 +323,7 @@ async def point_query(
 - question: 关于图像的问题
 - compile: 是否编译模型
 - return_image: 是否返回原图像
+- image_format: 返回图像的编码格式（jpeg / png / webp，默认 jpeg）
 
 **返回格式：**
 ```json
@@ -268,28 +338,26 @@ async def answer_question(
     file: UploadFile = File(..., description="要分析的图像文件"),
     question: str = Form(..., description="关于图像的问题"),
     compile: bool = Form(default=False, description="是否编译模型"),
-    return_image: bool = Form(default=False, description="是否返回原图像")
+    return_image: bool = Form(default=False, description="是否返回原图像"),
+    image_format: str = Form(default="jpeg", description="返回图像格式：jpeg / png / webp")
 ):
     """回答关于图像的问题"""
+    image_format = _resolve_image_format(image_format)
     try:
-        # 读取图像
-        contents = await file.read()
-        image = Image.open(BytesIO(contents)).convert("RGB")
+        # 读取图像（在线程池中解码，避免阻塞事件循环）
+        image = await read_pil_imagefile_async(file)
         
         # 获取模型实例
-        model = get_model_instance(compile=compile)
+        model = await get_model_instance(compile=compile)
         
         # 执行问答
-        result = model.answer(image, question)
+        result = await _run_inference(model.answer, image, question)
         
         # 如果需要返回图像，编码原图
         if return_image:
-            buffered = BytesIO()
-            image.save(buffered, format="PNG")
-            img_str = base64.b64encode(buffered.getvalue()).decode()
-            result["annotated_image"] = img_str
+            result["annotated_image"] = await asyncio.to_thread(encode_pil_image_to_base64, image, image_format)
         
-        return JSONResponse(content=result)
+        return ORJSONResponse(content=result)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"推理失败: {str(e)}")
@@ -301,7 +369,7 @@ async def health_check():
     """检查服务健康状态"""
     try:
         # 尝试获取模型实例
-        model = get_model_instance()
+        model = await get_model_instance()
         model_loaded = model.model is not None
         
         return {
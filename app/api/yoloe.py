@@ -6,19 +6,39 @@
 #   except in the case of brief quotations embodied in critical reviews and certain other noncommercial uses permitted by copyright law.
 """
 
+import asyncio
 import base64
-import io
+import functools
 import json
 import logging
+import multiprocessing
+import os
+import re
+import threading
+import uuid
 import zipfile
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-from typing import List, Optional, Dict, Any, Union
-from fastapi import APIRouter, File, Form, UploadFile, HTTPException, Body
-from fastapi.responses import Response, StreamingResponse
-from pydantic import BaseModel, Field
-
-from app.models.yoloe import BatchExportYoloRequest, ExportYoloRequest
-from app.utils.tools import read_imagefile_async, encode_mask_to_base64, encode_bgr_image_to_base64
+import orjson
+from typing import List, Optional, Dict, Any, Tuple, Type, Union
+from fastapi import APIRouter, File, Form, UploadFile, HTTPException, Body, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
+
+from app.models.yoloe import BatchExportYoloRequest, ExportYoloRequest, VisualPromptData
+from app.utils.tools import (
+    read_imagefile_async,
+    encode_mask_to_base64,
+    encode_mask_to_png,
+    encode_packed_masks_to_base64,
+    pack_masks,
+    encode_bgr_image_to_base64,
+    encode_bgr_image_raw,
+    normalize_image_format,
+    IMAGE_FORMATS,
+    IMAGE_MEDIA_TYPES,
+)
 
 # Assuming YOLOE class is correctly defined and imported
 try:
@@ -31,26 +51,323 @@ except ImportError:
         def prompt_free_predict(self, **kwargs): return []
         def text_predict(self, **kwargs): return []
         def image_predict(self, **kwargs): return []
+        def results_to_dict(self, results): return {}
 
 # Import the conversion utility
-from app.utils.conversion import convert_to_yolo_format
+from app.utils.conversion import AnnotationBatch, convert_annotation_models_to_yolo, convert_batch_item_to_yolo
+from app.config import config
+from app.cv.inference.yolo.batcher import MicroBatcher
 
 import cv2
 from PIL import Image
 
 router = APIRouter()
 
+# Cached YOLOE instances, keyed by model_path
+_yoloe_cache: Dict[str, YOLOE] = {}
+_yoloe_lock = asyncio.Lock()
+
+
+async def get_yoloe(model_path: str) -> YOLOE:
+    """
+    Returns the cached YOLOE instance for `model_path`, loading it on first use.
+
+    Weights are loaded once per model_path and stay resident for subsequent requests.
+    """
+    model = _yoloe_cache.get(model_path)
+    if model is not None:
+        return model
+    async with _yoloe_lock:
+        model = _yoloe_cache.get(model_path)
+        if model is None:
+            model = await asyncio.to_thread(YOLOE, model_path=model_path)
+            _yoloe_cache[model_path] = model
+        return model
+
+
+def clear_yoloe_cache() -> int:
+    """
+    Drops all cached YOLOE instances so their (GPU) memory can be released.
+
+    Returns:
+        Number of instances that were evicted.
+    """
+    count = len(_yoloe_cache)
+    _yoloe_cache.clear()
+    try:
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    except ImportError:
+        pass
+    return count
+
+
+def _run_yoloe_batch(key: tuple, items: List[Any]) -> List[Any]:
+    """
+    Runs one batched YOLOE forward pass for requests sharing the same key.
+
+    Key layout: (mode, model, prompt, conf, iou, retina_masks, image_shape).
+    Prompt-free and text-prompted items are BGR images; the image shape is
+    part of the key because Ultralytics letterboxes mixed-size batches to a
+    square instead of the minimal rectangle used for a single image, so only
+    same-size images are grouped and a batched result matches a single call.
+    Image-prompted items are (image, visual_prompts, refer_image) tuples and
+    are never grouped.
+
+    Returns:
+        One Ultralytics Results object per item, in order.
+    """
+    mode, model, prompt, conf, iou, retina_masks, _ = key
+    common = dict(conf=conf, iou=iou, return_dict=False, save=False, retina_masks=retina_masks)
+    # A list of arrays is predicted as a single batch; keep single requests unchanged
+    source = items[0] if len(items) == 1 else items
+
+    if mode == "prompt-free":
+        return model.prompt_free_predict(source=source, **common)
+    if mode == "text-prompted":
+        return model.text_predict(source=source, class_names=list(prompt), **common)
+
+    img_bgr, visual_prompts, refer_bgr = items[0]
+    return model.image_predict(
+        source=img_bgr,
+        visual_prompts=visual_prompts,
+        refer_image=refer_bgr,
+        **common
+    )
+
+
+# Coalesces concurrent requests into batched predict calls and serializes all
+# access to the (stateful) cached YOLOE instances
+_batching = config.get_batching_settings()
+yoloe_batcher = MicroBatcher(
+    _run_yoloe_batch,
+    max_batch=_batching["max_batch"] if _batching["enabled"] else 1,
+    max_wait_ms=_batching["max_wait_ms"] if _batching["enabled"] else 0
+)
+
+
+def _resolve_image_format(image_format: str) -> str:
+    """
+    Validates the requested annotated-image format, mapping bad values to a 400.
+    """
+    try:
+        return normalize_image_format(image_format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+# Segmentation mask encodings: PNG per mask (default) or packed 1-bit bitmaps
+MASK_FORMATS = ("png", "bitmap")
+
+
+def _resolve_mask_format(mask_format: str) -> str:
+    """
+    Validates the requested segmentation-mask format, mapping bad values to a 400.
+    """
+    normalized = (mask_format or "png").lower()
+    if normalized not in MASK_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported mask format '{mask_format}'. Expected one of: {', '.join(MASK_FORMATS)}."
+        )
+    return normalized
+
+
+def _plot_image(result: Any) -> np.ndarray:
+    """
+    Renders the annotated preview (BGR) for one Results object.
+    """
+    if result.boxes is None or len(result.boxes) == 0:
+        # Nothing to draw: plot() would only copy the input image
+        return result.orig_img
+    return result.plot()
+
+
+def _plot_to_base64(result: Any, image_format: str = "jpeg") -> str:
+    """
+    Renders the annotated preview for one Results object and encodes it as base64.
+    """
+    return encode_bgr_image_to_base64(_plot_image(result), image_format)
+
+
+def _plot_to_bytes(result: Any, image_format: str = "jpeg") -> bytes:
+    """
+    Renders the annotated preview for one Results object and encodes it as raw image bytes.
+    """
+    return encode_bgr_image_raw(_plot_image(result), image_format)
+
+
+async def _annotated_image_response(result: Any, image_format: str) -> Response:
+    """
+    Returns the annotated preview as a binary image response (no base64/JSON wrapping).
+    """
+    content = await asyncio.to_thread(_plot_to_bytes, result, image_format)
+    return Response(content=content, media_type=IMAGE_MEDIA_TYPES[image_format])
+
+
+def _encode_masks(masks: Any) -> List[str]:
+    """
+    Encodes every segmentation mask of one Results object as base64 PNG.
+    """
+    # Scale and cast on the device, then copy all masks to host in one transfer
+    masks_np = masks.data.mul(255).byte().cpu().numpy()
+    return [encode_mask_to_base64(mask) for mask in masks_np]
+
+
+def _encode_masks_bitmap(masks: Any) -> List[str]:
+    """
+    Encodes every segmentation mask of one Results object as a packed base64 bitmap.
+    """
+    # Threshold on the device so only booleans are copied to host
+    return encode_packed_masks_to_base64(masks.data.gt(0.5).cpu().numpy())
+
+
+async def _build_response_data(
+    model: YOLOE,
+    raw_results: List[Any],
+    return_image: bool,
+    retina_masks: bool,
+    image_format: str = "jpeg",
+    mask_format: str = "png"
+) -> Dict[str, Any]:
+    """
+    Builds the endpoint response from a single inference pass.
+
+    The JSON summary, the annotated image and the segmentation masks are all
+    derived from the same raw Ultralytics results, so the model only runs once.
+    The three parts are independent and are produced concurrently in worker threads.
+
+    With mask_format="bitmap" the masks are packed to 1 bit per pixel and the
+    response gains "mask_shape": [H, W] for unpacking.
+    """
+    jobs = {"results": asyncio.to_thread(model.results_to_dict, raw_results)}
+
+    if raw_results:
+        if return_image:
+            jobs["annotated_image"] = asyncio.to_thread(_plot_to_base64, raw_results[0], image_format)
+        # Ultralytics leaves masks as None when nothing was detected
+        masks = getattr(raw_results[0], 'masks', None)
+        if retina_masks and masks is not None:
+            encode = _encode_masks_bitmap if mask_format == "bitmap" else _encode_masks
+            jobs["segmentation_masks"] = asyncio.to_thread(encode, masks)
+
+    values = await asyncio.gather(*jobs.values())
+    response = dict(zip(jobs.keys(), values))
+    if mask_format == "bitmap" and "segmentation_masks" in response:
+        response["mask_shape"] = list(masks.data.shape[1:])
+    return response
+
+
+def _masks_to_parts(masks: Any, mask_format: str) -> List[bytes]:
+    """
+    Encodes every segmentation mask of one Results object as raw bytes
+    (PNG, or a packed 1-bit bitmap with mask_format="bitmap").
+    """
+    if mask_format == "bitmap":
+        return [row.tobytes() for row in pack_masks(masks.data.gt(0.5).cpu().numpy())]
+    return [encode_mask_to_png(mask) for mask in masks.data.mul(255).byte().cpu().numpy()]
+
+
+def _wants_multipart(request: Request) -> bool:
+    """
+    Whether the client asked for a multipart/mixed response via the Accept header.
+    """
+    return "multipart/mixed" in request.headers.get("accept", "")
+
+
+async def _build_multipart_response(
+    model: YOLOE,
+    raw_results: List[Any],
+    return_image: bool,
+    retina_masks: bool,
+    image_format: str = "jpeg",
+    mask_format: str = "png"
+) -> Response:
+    """
+    Builds the endpoint response as multipart/mixed instead of JSON.
+
+    The first part ("results") is the JSON summary, plus "mask_shape" when
+    masks are bitmaps. It is followed by the annotated image ("annotated_image")
+    and one part per mask ("segmentation_masks", filename mask_<i>.png or
+    mask_<i>.bin), all as raw bytes. Skipping base64 makes the body about 25%
+    smaller and saves the encode/decode on both ends.
+    """
+    jobs = {"results": asyncio.to_thread(model.results_to_dict, raw_results)}
+    masks = None
+    if raw_results:
+        if return_image:
+            jobs["annotated_image"] = asyncio.to_thread(_plot_to_bytes, raw_results[0], image_format)
+        # Ultralytics leaves masks as None when nothing was detected
+        masks = getattr(raw_results[0], 'masks', None)
+        if retina_masks and masks is not None:
+            jobs["segmentation_masks"] = asyncio.to_thread(_masks_to_parts, masks, mask_format)
+
+    values = dict(zip(jobs.keys(), await asyncio.gather(*jobs.values())))
+    metadata = {"results": values["results"]}
+    if mask_format == "bitmap" and "segmentation_masks" in values:
+        metadata["mask_shape"] = list(masks.data.shape[1:])
+
+    parts = [("results", None, "application/json", orjson.dumps(metadata))]
+    if "annotated_image" in values:
+        extension = IMAGE_FORMATS[image_format][0]
+        parts.append(("annotated_image", f"annotated{extension}", IMAGE_MEDIA_TYPES[image_format],
+                      values["annotated_image"]))
+    if "segmentation_masks" in values:
+        mask_type, mask_ext = ("application/octet-stream", "bin") if mask_format == "bitmap" else ("image/png", "png")
+        parts.extend(("segmentation_masks", f"mask_{i}.{mask_ext}", mask_type, content)
+                     for i, content in enumerate(values["segmentation_masks"]))
+
+    boundary = uuid.uuid4().hex
+    chunks = []
+    for name, filename, content_type, content in parts:
+        disposition = f'inline; name="{name}"' + (f'; filename="{filename}"' if filename else "")
+        chunks.append(
+            f"--{boundary}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Disposition: {disposition}\r\n\r\n".encode()
+        )
+        chunks.append(content)
+        chunks.append(b"\r\n")
+    chunks.append(f"--{boundary}--\r\n".encode())
+    return Response(content=b"".join(chunks), media_type=f"multipart/mixed; boundary={boundary}")
+
+
+async def _build_response(
+    request: Request,
+    model: YOLOE,
+    raw_results: List[Any],
+    return_image: bool,
+    retina_masks: bool,
+    image_format: str = "jpeg",
+    mask_format: str = "png"
+) -> Response:
+    """
+    Returns the JSON response, or multipart/mixed when the client accepts it.
+    """
+    if _wants_multipart(request):
+        return await _build_multipart_response(
+            model, raw_results, return_image, retina_masks, image_format, mask_format
+        )
+    # Return the response directly so FastAPI skips jsonable_encoder on the large payload
+    return ORJSONResponse(await _build_response_data(
+        model, raw_results, return_image, retina_masks, image_format, mask_format
+    ))
 
 
 @router.post("/prompt-free")
 async def prompt_free_inference(
+    request: Request,
     file: UploadFile = File(...),
     model_path: Optional[str] = Form("default"),
     conf: float = Form(0.25),
     iou: float = Form(0.7),
     return_image: bool = Form(False),
-    retina_masks: bool = Form(False)
+    retina_masks: bool = Form(False),
+    image_format: str = Form("jpeg"),
+    mask_format: str = Form("png")
 ):
+    image_format = _resolve_image_format(image_format)
+    mask_format = _resolve_mask_format(mask_format)
     try:
         img_bgr = await read_imagefile_async(file)
     except ValueError as e:
@@ -60,52 +377,63 @@ async def prompt_free_inference(
         raise HTTPException(status_code=500, detail="Error processing image file.")
 
     try:
-        model = YOLOE(model_path=model_path)
-        results_json = model.prompt_free_predict(
-            source=img_bgr,
-            conf=conf,
-            iou=iou,
-            return_dict=True,
-            save=False,
-            retina_masks=retina_masks
+        model = await get_yoloe(model_path)
+        result = await yoloe_batcher.submit(
+            ("prompt-free", model, None, conf, iou, retina_masks, img_bgr.shape), img_bgr
         )
-        response_data = {"results": results_json}
-
-        if return_image or (retina_masks and results_json.get("detection_results")):
-            raw_results = model.prompt_free_predict(
-                source=img_bgr,
-                conf=conf,
-                iou=iou,
-                return_dict=False,
-                save=False,
-                retina_masks=retina_masks
-            )
-            if raw_results:
-                if return_image:
-                    annotated_bgr = raw_results[0].plot()
-                    response_data["annotated_image"] = encode_bgr_image_to_base64(annotated_bgr)
-                if retina_masks and hasattr(raw_results[0], 'masks') and raw_results[0].masks is not None:
-                    masks = raw_results[0].masks.data
-                    encoded_masks = []
-                    for i in range(len(masks)):
-                        mask = masks[i].cpu().numpy() * 255
-                        encoded_masks.append(encode_mask_to_base64(mask.astype(np.uint8)))
-                    response_data["segmentation_masks"] = encoded_masks
-        return response_data
+        return await _build_response(
+            request, model, [result], return_image, retina_masks, image_format, mask_format
+        )
+    except Exception as e:
+        logging.error(f"Error during prompt-free inference: {e}")
+        raise HTTPException(status_code=500, detail=f"Inference failed: {e}")
+
+@router.post("/prompt-free/annotated")
+async def prompt_free_annotated_image(
+    file: UploadFile = File(...),
+    model_path: Optional[str] = Form("default"),
+    conf: float = Form(0.25),
+    iou: float = Form(0.7),
+    image_format: str = Form("jpeg")
+):
+    """
+    Same inference as /prompt-free, but returns only the annotated image as
+    raw bytes (e.g. image/jpeg), usable directly as an <img> source.
+    """
+    image_format = _resolve_image_format(image_format)
+    try:
+        img_bgr = await read_imagefile_async(file)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logging.error(f"Unexpected error reading image: {e}")
+        raise HTTPException(status_code=500, detail="Error processing image file.")
+
+    try:
+        model = await get_yoloe(model_path)
+        result = await yoloe_batcher.submit(
+            ("prompt-free", model, None, conf, iou, False, img_bgr.shape), img_bgr
+        )
+        return await _annotated_image_response(result, image_format)
     except Exception as e:
         logging.error(f"Error during prompt-free inference: {e}")
         raise HTTPException(status_code=500, detail=f"Inference failed: {e}")
 
 @router.post("/text-prompt")
 async def text_prompt_inference(
+    request: Request,
     file: UploadFile = File(...),
     class_names: List[str] = Form(...),
     model_path: Optional[str] = Form("default"),
     conf: float = Form(0.25),
     iou: float = Form(0.7),
     return_image: bool = Form(False),
-    retina_masks: bool = Form(False)
+    retina_masks: bool = Form(False),
+    image_format: str = Form("jpeg"),
+    mask_format: str = Form("png")
 ):
+    image_format = _resolve_image_format(image_format)
+    mask_format = _resolve_mask_format(mask_format)
     try:
         img_bgr = await read_imagefile_async(file)
     except ValueError as e:
@@ -118,44 +446,180 @@ async def text_prompt_inference(
          raise HTTPException(status_code=400, detail="Class names list cannot be empty.")
 
     try:
-        model = YOLOE(model_path=model_path)
-        results_json = model.text_predict(
-            source=img_bgr,
-            class_names=class_names,
-            conf=conf,
-            iou=iou,
-            return_dict=True,
-            save=False,
-            retina_masks=retina_masks
+        model = await get_yoloe(model_path)
+        result = await yoloe_batcher.submit(
+            ("text-prompted", model, tuple(class_names), conf, iou, retina_masks, img_bgr.shape), img_bgr
+        )
+        return await _build_response(
+            request, model, [result], return_image, retina_masks, image_format, mask_format
         )
-        response_data = {"results": results_json}
-
-        if return_image or (retina_masks and results_json.get("detection_results")):
-            raw_results = model.text_predict(
-                source=img_bgr,
-                class_names=class_names,
-                conf=conf,
-                iou=iou,
-                return_dict=False,
-                save=False,
-                retina_masks=retina_masks
-            )
-            if raw_results:
-                if return_image:
-                    annotated_bgr = raw_results[0].plot()
-                    response_data["annotated_image"] = encode_bgr_image_to_base64(annotated_bgr)
-                if retina_masks and hasattr(raw_results[0], 'masks') and raw_results[0].masks is not None:
-                    masks = raw_results[0].masks.data
-                    encoded_masks = []
-                    for i in range(len(masks)):
-                        mask = masks[i].cpu().numpy() * 255
-                        encoded_masks.append(encode_mask_to_base64(mask.astype(np.uint8)))
-                    response_data["segmentation_masks"] = encoded_masks
-        return response_data
     except Exception as e:
         logging.error(f"Error during text-prompt inference: {e}")
         raise HTTPException(status_code=500, detail=f"Inference failed: {e}")
 
+@router.post("/text-prompt/annotated")
+async def text_prompt_annotated_image(
+    file: UploadFile = File(...),
+    class_names: List[str] = Form(...),
+    model_path: Optional[str] = Form("default"),
+    conf: float = Form(0.25),
+    iou: float = Form(0.7),
+    image_format: str = Form("jpeg")
+):
+    """
+    Same inference as /text-prompt, but returns only the annotated image as
+    raw bytes (e.g. image/jpeg), usable directly as an <img> source.
+    """
+    image_format = _resolve_image_format(image_format)
+    try:
+        img_bgr = await read_imagefile_async(file)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logging.error(f"Unexpected error reading image: {e}")
+        raise HTTPException(status_code=500, detail="Error processing image file.")
+
+    if not class_names:
+         raise HTTPException(status_code=400, detail="Class names list cannot be empty.")
+
+    try:
+        model = await get_yoloe(model_path)
+        result = await yoloe_batcher.submit(
+            ("text-prompted", model, tuple(class_names), conf, iou, False, img_bgr.shape), img_bgr
+        )
+        return await _annotated_image_response(result, image_format)
+    except Exception as e:
+        logging.error(f"Error during text-prompt inference: {e}")
+        raise HTTPException(status_code=500, detail=f"Inference failed: {e}")
+
+# Patterns used by the lenient visual-prompt parser
+_BRACKET_FIX = re.compile(r'\[\s*(\d+)\s*,\s*(\d+)\s*\[')
+_DIGITS = re.compile(r'\d+')
+_QUOTES_TO_DOUBLE = str.maketrans({"'": '"'})
+_CLS_CLEANUP = str.maketrans({"'": '"', " ": None})
+# One pass equivalent to the sequential replaces "][" -> "],[", "[," -> "[0,", ",[" -> ",[0"
+# (later replaces also rewrite text produced by earlier ones, hence "[00" for ",[,")
+_BRACKET_REPAIRS = re.compile(r"((?<=[,\]])\[(?=,))|((?<=[,\]])\[)|(\[(?=,))|(\](?=\[))")
+_BRACKET_REPAIR_SUBS = (None, "[00", "[0", "[0", "],")
+
+
+def _repair_visual_prompts(bboxes: str, cls: str) -> Tuple[Any, Any]:
+    """
+    Lenient fallback parser for hand-written visual prompts that are not valid JSON
+    (single quotes, missing commas, stray brackets, ...).
+
+    Returns:
+        (bboxes_list, cls_list) as parsed/repaired Python objects.
+    """
+    # bboxes may still be valid JSON when only cls was malformed
+    try:
+        bboxes_list = orjson.loads(bboxes)
+    except json.JSONDecodeError:
+        # If standard JSON fails, try fixing common formatting issues
+
+        # Replace single quotes with double quotes
+        fixed_bboxes = bboxes.translate(_QUOTES_TO_DOUBLE)
+
+        # Fix missing commas between brackets and malformed brackets like [[0,200[
+        fixed_bboxes = _BRACKET_REPAIRS.sub(
+            lambda m: _BRACKET_REPAIR_SUBS[m.lastindex], fixed_bboxes
+        )
+
+        # Replace invalid entries like [0,200[ with [0,200]
+        fixed_bboxes = _BRACKET_FIX.sub(r'[\1,\2]', fixed_bboxes)
+
+        try:
+            bboxes_list = orjson.loads(fixed_bboxes)
+        except json.JSONDecodeError as e:
+            # Try a more aggressive fix - manually parsing for those formats
+            try:
+                if "[[" in bboxes and "]]" in bboxes:
+                    # Extract all numeric values
+                    numbers = _DIGITS.findall(bboxes)
+
+                    # Count brackets to determine how many bboxes there should be
+                    # Subtract 1 for the outer brackets
+                    open_brackets = bboxes.count('[') - 1
+                    close_brackets = bboxes.count(']') - 1
+
+                    # Use class list length as a hint if available
+                    try:
+                        cls_count = len(orjson.loads(cls))
+                    except:
+                        try:
+                            cls_count = len(_DIGITS.findall(cls))
+                        except:
+                            cls_count = 0
+
+                    # Determine how many bboxes we likely have
+                    num_bboxes = max(open_brackets, close_brackets, len(numbers) // 4, cls_count)
+
+                    # Group numbers in sets of 4 for bounding boxes [x1,y1,x2,y2]
+                    bboxes_list = []
+                    for i in range(0, min(len(numbers), num_bboxes * 4), 4):
+                        if i+3 < len(numbers):
+                            bboxes_list.append([int(numbers[i]), int(numbers[i+1]),
+                                              int(numbers[i+2]), int(numbers[i+3])])
+
+                    # If we don't have enough boxes, add dummy boxes to match cls count
+                    while len(bboxes_list) < num_bboxes:
+                        bboxes_list.append([0, 0, 100, 100])  # Add dummy box
+                else:
+                    raise ValueError("Could not parse bboxes format")
+            except Exception as parse_err:
+                # Provide more helpful error message with example
+                raise ValueError(f"Invalid bboxes format. Expected format: [[x1,y1,x2,y2], [x1,y1,x2,y2]]. Error: {e}")
+
+    # Parse cls with similar error handling
+    try:
+        cls_list = orjson.loads(cls)
+    except json.JSONDecodeError:
+        # Clean up the cls format
+        fixed_cls = cls.translate(_CLS_CLEANUP)
+
+        try:
+            cls_list = orjson.loads(fixed_cls)
+        except json.JSONDecodeError as e:
+            # If still failing, try to extract numbers directly
+            try:
+                cls_list = [int(n) for n in _DIGITS.findall(cls)]
+            except Exception:
+                raise ValueError(f"Invalid cls format. Expected format: [0, 1, 2]. Error: {e}")
+
+    return bboxes_list, cls_list
+
+
+@functools.lru_cache(maxsize=128)
+def _parse_visual_prompts(bboxes: str, cls: str) -> VisualPromptData:
+    """
+    Parses the form-encoded `bboxes` / `cls` fields into validated visual prompts.
+
+    Well-formed JSON (what the frontend sends) is parsed with orjson and validated
+    against the VisualPromptData schema in one pass; only malformed input goes
+    through the lenient repair path. Results are cached by the raw strings, so
+    callers must treat the returned model as read-only (failures are not cached).
+
+    Raises:
+        ValueError: If the prompts cannot be parsed or fail validation.
+    """
+    if not bboxes or bboxes.isspace():
+        raise ValueError("bboxes parameter cannot be empty")
+    if not cls or cls.isspace():
+        raise ValueError("cls parameter cannot be empty")
+
+    try:
+        bboxes_list, cls_list = orjson.loads(bboxes), orjson.loads(cls)
+    except orjson.JSONDecodeError:
+        bboxes_list, cls_list = _repair_visual_prompts(bboxes, cls)
+
+    try:
+        return VisualPromptData(bboxes=bboxes_list, cls=cls_list)
+    except ValidationError as e:
+        # Report custom validator messages without pydantic's "Value error, " prefix
+        messages = [str(err.get("ctx", {}).get("error", err["msg"])) for err in e.errors()]
+        raise ValueError("; ".join(messages)) from None
+
+
 @router.post("/image-prompt",
     summary="Run YOLOe detection with visual prompts",
     description="""
@@ -178,6 +642,7 @@ async def text_prompt_inference(
     """
 )
 async def image_prompt_inference(
+    request: Request,
     file: UploadFile = File(..., description="Target image for detection"),
     bboxes: str = Form(..., description="JSON array of bounding boxes. Format: [[x1,y1,x2,y2], [x1,y1,x2,y2], ...]"),
     cls: str = Form(..., description="JSON array of class IDs (must start from 0). Format: [0, 1, ...]"),
@@ -186,185 +651,82 @@ async def image_prompt_inference(
     iou: float = Form(0.7, description="IoU threshold for non-max suppression (0.0-1.0)"),
     return_image: bool = Form(False, description="If true, returns annotated image in base64 format"),
     retina_masks: bool = Form(False, description="If true, returns high-quality segmentation masks"),
+    image_format: str = Form("jpeg", description="Encoding of the annotated image: jpeg, png or webp"),
+    mask_format: str = Form("png", description="Encoding of segmentation masks: png, or bitmap (1 bit/pixel, see mask_shape)"),
     refer_file: Optional[UploadFile] = File(None, description="Reference image containing visual prompt examples (optional)")
 ):
-    try:
-        img_bgr = await read_imagefile_async(file)
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=f"Invalid target image: {e}")
-    except Exception as e:
-        logging.error(f"Unexpected error reading target image: {e}")
-        raise HTTPException(status_code=500, detail="Error processing target image file.")
+    image_format = _resolve_image_format(image_format)
+    mask_format = _resolve_mask_format(mask_format)
 
-    refer_bgr = None
+    # Decode the target and reference images concurrently
+    reads = [read_imagefile_async(file)]
     if refer_file is not None:
-        try:
-            refer_bgr = await read_imagefile_async(refer_file)
-        except ValueError as e:
-            raise HTTPException(status_code=400, detail=f"Invalid reference image: {e}")
-        except Exception as e:
-            logging.error(f"Unexpected error reading reference image: {e}")
-            raise HTTPException(status_code=500, detail="Error processing reference image file.")
-
-    try:
-        # Validate JSON inputs with proper error handling
-        if not bboxes or bboxes.isspace():
-            raise ValueError("bboxes parameter cannot be empty")
-        if not cls or cls.isspace():
-            raise ValueError("cls parameter cannot be empty")
-
-        # First, try to parse standard JSON format
-        try:
-            bboxes_list = json.loads(bboxes)
-        except json.JSONDecodeError:
-            # If standard JSON fails, try fixing common formatting issues
-
-            # Replace single quotes with double quotes
-            fixed_bboxes = bboxes.replace("'", "\"")
+        reads.append(read_imagefile_async(refer_file))
+    decoded = await asyncio.gather(*reads, return_exceptions=True)
 
-            # Fix missing commas between brackets
-            fixed_bboxes = fixed_bboxes.replace("][", "],[")
+    for label, outcome in zip(("target", "reference"), decoded):
+        if isinstance(outcome, ValueError):
+            raise HTTPException(status_code=400, detail=f"Invalid {label} image: {outcome}")
+        if isinstance(outcome, BaseException):
+            logging.error(f"Unexpected error reading {label} image: {outcome}")
+            raise HTTPException(status_code=500, detail=f"Error processing {label} image file.")
 
-            # Fix malformed brackets with incorrect syntax like [[0,200[
-            fixed_bboxes = fixed_bboxes.replace("[,", "[0,")
-            fixed_bboxes = fixed_bboxes.replace(",[", ",[0")
-            fixed_bboxes = fixed_bboxes.replace("[", "[")
-            fixed_bboxes = fixed_bboxes.replace("]", "]")
+    img_bgr = decoded[0]
+    refer_bgr = decoded[1] if refer_file is not None else None
 
-            # Replace invalid entries like [0,200[ with [0,200]
-            import re
-            fixed_bboxes = re.sub(r'\[\s*(\d+)\s*,\s*(\d+)\s*\[', r'[\1,\2]', fixed_bboxes)
-
-            try:
-                bboxes_list = json.loads(fixed_bboxes)
-            except json.JSONDecodeError as e:
-                # Try a more aggressive fix - manually parsing for those formats
-                try:
-                    if "[[" in bboxes and "]]" in bboxes:
-                        # Extract all numeric values
-                        import re
-                        numbers = re.findall(r'\d+', bboxes)
-
-                        # Count brackets to determine how many bboxes there should be
-                        # Subtract 1 for the outer brackets
-                        open_brackets = bboxes.count('[') - 1
-                        close_brackets = bboxes.count(']') - 1
-
-                        # Use class list length as a hint if available
-                        try:
-                            cls_count = len(json.loads(cls))
-                        except:
-                            try:
-                                cls_count = len(re.findall(r'\d+', cls))
-                            except:
-                                cls_count = 0
-
-                        # Determine how many bboxes we likely have
-                        num_bboxes = max(open_brackets, close_brackets, len(numbers) // 4, cls_count)
-
-                        # Group numbers in sets of 4 for bounding boxes [x1,y1,x2,y2]
-                        bboxes_list = []
-                        for i in range(0, min(len(numbers), num_bboxes * 4), 4):
-                            if i+3 < len(numbers):
-                                bboxes_list.append([int(numbers[i]), int(numbers[i+1]),
-                                                  int(numbers[i+2]), int(numbers[i+3])])
-
-                        # If we don't have enough boxes, add dummy boxes to match cls count
-                        while len(bboxes_list) < num_bboxes:
-                            bboxes_list.append([0, 0, 100, 100])  # Add dummy box
-                    else:
-                        raise ValueError("Could not parse bboxes format")
-                except Exception as parse_err:
-                    # Provide more helpful error message with example
-                    raise ValueError(f"Invalid bboxes format. Expected format: [[x1,y1,x2,y2], [x1,y1,x2,y2]]. Error: {e}")
-
-        # Parse cls with similar error handling
-        try:
-            cls_list = json.loads(cls)
-        except json.JSONDecodeError:
-            # Clean up the cls format
-            fixed_cls = cls.replace("'", "\"")
-            fixed_cls = fixed_cls.replace(" ", "")
-
-            try:
-                cls_list = json.loads(fixed_cls)
-            except json.JSONDecodeError as e:
-                # If still failing, try to extract numbers directly
-                try:
-                    import re
-                    cls_list = [int(n) for n in re.findall(r'\d+', cls)]
-                except Exception:
-                    raise ValueError(f"Invalid cls format. Expected format: [0, 1, 2]. Error: {e}")
-
-        # Validate data types and formats
-        if not isinstance(bboxes_list, list):
-            raise ValueError("bboxes must be a JSON array of arrays.")
-        if not isinstance(cls_list, list):
-            raise ValueError("cls must be a JSON array of integers.")
-
-        # Check that each bbox is a list of 4 coordinates
-        for i, bbox in enumerate(bboxes_list):
-            if not isinstance(bbox, list) or len(bbox) != 4:
-                raise ValueError(f"Each bounding box must contain exactly 4 values [x1,y1,x2,y2]. Error in box {i+1}: {bbox}")
-
-        # Validate class IDs are sequential starting from 0
-        # Check if lengths match
-        if len(bboxes_list) != len(cls_list):
-            raise ValueError(f"Length of bboxes ({len(bboxes_list)}) must match length of cls ({len(cls_list)}). " +
-                           f"Each bounding box must have a corresponding class ID. " +
-                           f"Please provide the same number of elements in both arrays.")
-    except (json.JSONDecodeError, ValueError) as e:
+    try:
+        prompts = _parse_visual_prompts(bboxes, cls)
+    except ValueError as e:
         raise HTTPException(status_code=400, detail=f"Invalid visual prompts format: {e}")
 
+    # Fill pre-sized arrays from flat iterators (boxes are validated to 4 values each),
+    # skipping np.array's nested-list shape and dtype inference
+    num_boxes = len(prompts.bboxes)
     visual_prompts = {
-        "bboxes": np.array(bboxes_list, dtype=np.float32),
-        "cls": np.array(cls_list, dtype=np.int32),
+        "bboxes": np.fromiter(
+            (v for bbox in prompts.bboxes for v in bbox), dtype=np.float32, count=num_boxes * 4
+        ).reshape(num_boxes, 4),
+        "cls": np.fromiter(prompts.cls, dtype=np.int32, count=len(prompts.cls)),
     }
 
     try:
-        model = YOLOE(model_path=model_path)
-        results_json = model.image_predict(
-            source=img_bgr,
-            visual_prompts=visual_prompts,
-            refer_image=refer_bgr,
-            conf=conf,
-            iou=iou,
-            return_dict=True,
-            save=False,
-            retina_masks=retina_masks
+        model = await get_yoloe(model_path)
+        # Visual prompts are per-image, so use a unique key: runs alone, but still serialized
+        result = await yoloe_batcher.submit(
+            ("image-prompted", model, object(), conf, iou, retina_masks, img_bgr.shape),
+            (img_bgr, visual_prompts, refer_bgr)
+        )
+        return await _build_response(
+            request, model, [result], return_image, retina_masks, image_format, mask_format
         )
-        response_data = {"results": results_json}
-
-        if return_image or (retina_masks and results_json.get("detection_results")):
-            raw_results = model.image_predict(
-                source=img_bgr,
-                visual_prompts=visual_prompts,
-                refer_image=refer_bgr,
-                conf=conf,
-                iou=iou,
-                return_dict=False,
-                save=False,
-                retina_masks=retina_masks
-            )
-            if raw_results:
-                if return_image:
-                    annotated_bgr = raw_results[0].plot()
-                    response_data["annotated_image"] = encode_bgr_image_to_base64(annotated_bgr)
-                if retina_masks and hasattr(raw_results[0], 'masks') and raw_results[0].masks is not None:
-                    masks = raw_results[0].masks.data
-                    encoded_masks = []
-                    for i in range(len(masks)):
-                        mask = masks[i].cpu().numpy() * 255
-                        encoded_masks.append(encode_mask_to_base64(mask.astype(np.uint8)))
-                    response_data["segmentation_masks"] = encoded_masks
-        return response_data
     except Exception as e:
         logging.error(f"Error during image-prompt inference: {e}")
         raise HTTPException(status_code=500, detail=f"Inference failed: {e}")
 
+@router.post("/cache/clear")
+async def clear_model_cache():
+    """
+    Releases all cached YOLOE models; they are reloaded on the next request.
+    """
+    async with _yoloe_lock:
+        cleared = clear_yoloe_cache()
+    return {"cleared": cleared}
+
 # ------------------------------------------------------
 # 4) Export YOLO Format Endpoint (Single Image)
 # ------------------------------------------------------
+def _convert_single_export(request_data: ExportYoloRequest) -> str:
+    """
+    Converts the annotations of a single-image export request to YOLO format.
+    """
+    return convert_annotation_models_to_yolo(
+        annotations=request_data.annotations,
+        image_width=request_data.image_width,
+        image_height=request_data.image_height,
+        class_name_to_id=request_data.class_name_to_id
+    )
+
+
 @router.post("/export/yolo")
 async def export_yolo_single(
     request_data: ExportYoloRequest = Body(...)
@@ -373,15 +735,8 @@ async def export_yolo_single(
     Converts annotations for a single image to YOLO format and returns as a text file.
     """
     try:
-        # Convert Pydantic AnnotationData models to simple dicts for the conversion function
-        annotations_dict_list = [ann.to_conversion_dict() for ann in request_data.annotations]
-
-        yolo_content = convert_to_yolo_format(
-            annotations=annotations_dict_list,
-            image_width=request_data.image_width,
-            image_height=request_data.image_height,
-            class_name_to_id=request_data.class_name_to_id
-        )
+        # Large annotation lists make the conversion CPU-bound; keep it off the event loop
+        yolo_content = await asyncio.to_thread(_convert_single_export, request_data)
 
         # Sanitize filename
         safe_filename_base = "".join(c if c.isalnum() or c in ('_', '-') else '_' for c in request_data.filename_base)
@@ -401,43 +756,184 @@ async def export_yolo_single(
 # ------------------------------------------------------
 # 5) Export YOLO Format Endpoint (Batch - Zip)
 # ------------------------------------------------------
-@router.post("/export/yolo-batch")
-async def export_yolo_batch(
-    request_data: BatchExportYoloRequest = Body(...)
-):
+# Entries smaller than this are stored uncompressed; deflate buys little on short label files.
+ZIP_STORE_THRESHOLD = 1024
+ZIP_STREAM_CHUNK_SIZE = 64 * 1024
+# Deflate level for label files; short numeric text compresses almost as well at 1 as at 6
+ZIP_COMPRESS_LEVEL = 1
+
+
+class _ZipChunkSink:
     """
-    Converts annotations for multiple images to YOLO format,
-    packages them into individual .txt files, and returns a zip archive.
+    Minimal write-only, non-seekable file object for zipfile. Written bytes are
+    buffered until drained by the streaming generator.
     """
-    try:
-        zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
-            for image_filename, image_data in request_data.images_data.items():
-                # Convert Pydantic AnnotationData models to simple dicts
-                annotations_dict_list = [ann.to_conversion_dict() for ann in image_data.annotations]
 
-                yolo_content = convert_to_yolo_format(
-                    annotations=annotations_dict_list,
-                    image_width=image_data.image_width,
-                    image_height=image_data.image_height,
-                    class_name_to_id=request_data.class_name_to_id
-                )
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self.size = 0
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
 
-                # Create a .txt filename based on the original image filename
-                base_name = image_filename.rsplit('.', 1)[0] # Remove extension
-                txt_filename = f"{base_name}.txt"
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        self.size = 0
+        return data
 
-                # Add the YOLO content as a file to the zip archive
-                zip_file.writestr(txt_filename, yolo_content)
 
-        zip_buffer.seek(0)
+# Process pool for converting very large batch exports, created on first use
+# Default worker cap when export.process_pool_workers is 0; each worker is a separate interpreter
+EXPORT_POOL_DEFAULT_WORKERS = 4
+_export_pool: Optional[ProcessPoolExecutor] = None
+_export_pool_lock = threading.Lock()
+
+
+def _get_export_pool() -> ProcessPoolExecutor:
+    """
+    Returns the shared export process pool, creating it lazily.
+
+    Uses the "spawn" start method: the server process holds CUDA state and
+    threads, which are not safe to fork. Spawned workers re-import the main
+    module, which is why main.py keeps the routers and model libraries out of
+    its module-level imports.
+    """
+    global _export_pool
+    with _export_pool_lock:
+        if _export_pool is None:
+            workers = (config.get_export_pool_settings()["workers"]
+                       or min(EXPORT_POOL_DEFAULT_WORKERS, os.cpu_count() or 1))
+            _export_pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _export_pool
+
 
+def shutdown_export_pool() -> None:
+    """
+    Shuts down the export process pool if it was started.
+    """
+    global _export_pool
+    with _export_pool_lock:
+        if _export_pool is not None:
+            _export_pool.shutdown(wait=False, cancel_futures=True)
+            _export_pool = None
+
+
+def _iter_yolo_zip(request_data: BatchExportYoloRequest, chunk_size: int = ZIP_STREAM_CHUNK_SIZE):
+    """
+    Converts every image in the batch to YOLO format and yields the zip archive
+    incrementally, so memory stays flat regardless of batch size.
+
+    This is a sync generator; StreamingResponse iterates it in the threadpool.
+    """
+    images = request_data.images_data.items()
+    class_name_to_id = request_data.class_name_to_id
+
+    # Spread very large batches over worker processes; results come back in order
+    total_annotations = sum(len(image_data.annotations) for _, image_data in images)
+    if total_annotations >= config.get_export_pool_settings()["min_annotations"]:
+        # Worker processes get column arrays, which pickle cheaply
+        jobs = (
+            (
+                AnnotationBatch.from_models(image_data.annotations),
+                image_data.image_width,
+                image_data.image_height,
+                class_name_to_id,
+            )
+            for _, image_data in images
+        )
+        yolo_contents = _get_export_pool().map(convert_batch_item_to_yolo, jobs, chunksize=32)
+    else:
+        # In-process, read the coordinates straight from the validated models
+        yolo_contents = (
+            convert_annotation_models_to_yolo(
+                image_data.annotations, image_data.image_width, image_data.image_height, class_name_to_id
+            )
+            for _, image_data in images
+        )
+
+    sink = _ZipChunkSink()
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED, compresslevel=ZIP_COMPRESS_LEVEL) as zip_file:
+        for (image_filename, _), yolo_content in zip(images, yolo_contents):
+            # Create a .txt filename based on the original image filename
+            base_name = image_filename.rsplit('.', 1)[0] # Remove extension
+            txt_filename = f"{base_name}.txt"
+
+            compress_type = zipfile.ZIP_STORED if len(yolo_content) < ZIP_STORE_THRESHOLD else zipfile.ZIP_DEFLATED
+            zip_file.writestr(txt_filename, yolo_content, compress_type=compress_type)
+
+            if sink.size >= chunk_size:
+                yield sink.drain()
+
+    # Closing the archive writes the central directory
+    tail = sink.drain()
+    if tail:
+        yield tail
+
+def _inline_schema(model: Type[BaseModel]) -> Dict[str, Any]:
+    """
+    Returns the model's JSON schema with all $defs references inlined, so it can
+    be embedded directly in an endpoint's OpenAPI requestBody.
+    """
+    schema = model.model_json_schema()
+    defs = schema.pop("$defs", {})
+
+    def resolve(node):
+        if isinstance(node, dict):
+            ref = node.get("$ref")
+            if ref is not None:
+                return resolve(defs[ref.rsplit("/", 1)[-1]])
+            return {key: resolve(value) for key, value in node.items()}
+        if isinstance(node, list):
+            return [resolve(value) for value in node]
+        return node
+
+    return resolve(schema)
+
+
+@router.post(
+    "/export/yolo-batch",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {"application/json": {"schema": _inline_schema(BatchExportYoloRequest)}},
+        }
+    },
+)
+async def export_yolo_batch(request: Request):
+    """
+    Converts annotations for multiple images to YOLO format,
+    packages them into individual .txt files, and returns a zip archive.
+
+    The body is validated straight from raw bytes with pydantic-core's JSON
+    parser, skipping the intermediate dict FastAPI would otherwise build for
+    large batch payloads.
+    """
+    try:
+        request_data = BatchExportYoloRequest.model_validate_json(await request.body())
+    except ValidationError as e:
+        # Same 422 shape FastAPI produces for Body(...) parameters
+        raise RequestValidationError(
+            [{**err, "loc": ("body", *err["loc"])} for err in e.errors(include_url=False)]
+        )
+
+    try:
         # Sanitize zip filename base
         safe_zip_filename_base = "".join(c if c.isalnum() or c in ('_', '-') else '_' for c in request_data.zip_filename_base)
         zip_filename = f"{safe_zip_filename_base}.zip"
 
+        # The archive is generated lazily; StreamingResponse drives the sync
+        # generator from the threadpool, keeping conversion off the event loop
         return StreamingResponse(
-            zip_buffer,
+            _iter_yolo_zip(request_data),
             media_type="application/zip",
             headers={
                 "Content-Disposition": f"attachment; filename={zip_filename}"
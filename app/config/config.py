@@ -1,7 +1,17 @@
+import functools
 import os
 import yaml
 from typing import Dict, Any, Optional
 
+# Prefer the libyaml-backed C loader when PyYAML was built with it
+try:
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader
+
+# Marks a key that is absent from the configuration
+_MISSING = object()
+
 class Config:
     """
     Configuration loader for the application.
@@ -25,6 +35,8 @@ class Config:
         
         self.config_path = config_path
         self.config: Dict[str, Any] = {}
+        # Memoized dotted-key lookups; cleared whenever the file is (re)loaded
+        self._lookup = functools.lru_cache(maxsize=128)(self._resolve)
         
         self.load_config()
     
@@ -32,13 +44,30 @@ class Config:
         """Load configuration from YAML file."""
         try:
             with open(self.config_path, 'r') as config_file:
-                self.config = yaml.safe_load(config_file)
+                self.config = yaml.load(config_file, Loader=_YamlLoader) or {}
         except FileNotFoundError:
             print(f"Warning: Configuration file not found at {self.config_path}")
             self.config = {}
         except yaml.YAMLError as e:
             print(f"Error parsing YAML configuration: {e}")
             self.config = {}
+        
+        self._lookup.cache_clear()
+        # Pre-resolve the model paths read on every model construction
+        self._yoloe_seg_path = self.get("models.yoloe.yoloe-seg", "")
+        self._yoloe_seg_pf_path = self.get("models.yoloe.yoloe-seg-pf", "")
+        self._yoloe_engine_path = self.get("models.yoloe.engine", "") or ""
+        self._moondream_model_path = self.get("models.moondream.model", "")
+    
+    def _resolve(self, key: str) -> Any:
+        """Walk the nested config for a dotted key, returning _MISSING if absent."""
+        value = self.config
+        for k in key.split('.'):
+            if isinstance(value, dict) and k in value:
+                value = value[k]
+            else:
+                return _MISSING
+        return value
     
     def get(self, key: str, default: Any = None) -> Any:
         """
@@ -53,16 +82,8 @@ class Config:
         Returns:
             Configuration value if found, default otherwise.
         """
-        keys = key.split('.')
-        value = self.config
-        
-        for k in keys:
-            if isinstance(value, dict) and k in value:
-                value = value[k]
-            else:
-                return default
-        
-        return value
+        value = self._lookup(key)
+        return default if value is _MISSING else value
     
     def get_models_config(self) -> Dict[str, Any]:
         """
@@ -89,7 +110,7 @@ class Config:
         Returns:
             Path to YOLOE-SEG model or an empty string if not configured.
         """
-        return self.get("models.yoloe.yoloe-seg", "")
+        return self._yoloe_seg_path
     
     def get_yoloe_seg_pf_path(self) -> str:
         """
@@ -98,7 +119,61 @@ class Config:
         Returns:
             Path to YOLOE-SEG-PF model or an empty string if not configured.
         """
-        return self.get("models.yoloe.yoloe-seg-pf", "")
+        return self._yoloe_seg_pf_path
+    
+    def get_yoloe_engine_path(self) -> str:
+        """
+        Get path to the prebuilt TensorRT engine of the YOLOE-SEG-PF model.
+        
+        Returns:
+            Path to the engine file or an empty string if not configured.
+        """
+        return self._yoloe_engine_path
+    
+    def get_yoloe_auto_export_engine(self) -> bool:
+        """
+        Whether to build a TensorRT engine for the YOLOE-SEG-PF model when none exists.
+        
+        Returns:
+            True to export on first load, False (default) to use the .pt weights.
+        """
+        return bool(self.get("models.yoloe.auto_export_engine", False))
+    
+    def get_yoloe_precision(self) -> str:
+        """
+        Get the YOLOE inference precision.
+        
+        Returns:
+            "fp16" (default), "fp32" or "int8".
+        """
+        return str(self.get("models.yoloe.precision", "fp16")).lower()
+    
+    def get_yoloe_engine_cache_dir(self) -> str:
+        """
+        Get the directory where exported TensorRT engines are cached.
+        
+        Returns:
+            Directory path, or an empty string to keep engines next to the weights.
+        """
+        return self.get("models.yoloe.engine_cache_dir", "") or ""
+    
+    def get_yoloe_calibration_data(self) -> str:
+        """
+        Get the dataset YAML used to calibrate INT8 TensorRT engine exports.
+        
+        Returns:
+            Path to the dataset YAML or an empty string if not configured.
+        """
+        return self.get("models.yoloe.calibration_data", "") or ""
+    
+    def get_yoloe_compile(self) -> bool:
+        """
+        Whether the YOLOE PyTorch models are wrapped in torch.compile.
+        
+        Returns:
+            True to compile, False (default) to run eagerly.
+        """
+        return bool(self.get("models.yoloe.compile", False))
     
     def get_moondream_model_path(self) -> str:
         """
@@ -107,7 +182,76 @@ class Config:
         Returns:
             Path to Moondream model or an empty string if not configured.
         """
-        return self.get("models.moondream.model", "")
+        return self._moondream_model_path
+    
+    def get_moondream_quantization(self) -> str:
+        """
+        Get the weight quantization applied when loading Moondream.
+        
+        Returns:
+            "none" (default), "int8", "nf4" or "fp8".
+        """
+        return str(self.get("models.moondream.quantization", "none")).lower()
+    
+    def get_thread_pool_workers(self) -> int:
+        """
+        Get the size of the thread pool used for blocking work in async handlers.
+        
+        Returns:
+            Number of worker threads (defaults to 8).
+        """
+        return int(self.get("server.thread_pool_workers", 8))
+    
+    def get_preload_models(self) -> bool:
+        """
+        Whether the default models should be loaded at application startup.
+        
+        Returns:
+            True to preload (default), False to load lazily on first request.
+        """
+        return bool(self.get("server.preload_models", True))
+    
+    def get_compile_settings(self) -> Dict[str, Any]:
+        """
+        Get torch.compile settings.
+        
+        Returns:
+            Dictionary with "mode", "cache_size_limit", "warmup" and
+            "inductor_cache_dir" (empty string when not configured).
+        """
+        return {
+            "mode": self.get("compile.mode", "reduce-overhead"),
+            "cache_size_limit": int(self.get("compile.cache_size_limit", 128)),
+            "warmup": bool(self.get("compile.warmup", True)),
+            "inductor_cache_dir": self.get("compile.inductor_cache_dir", "") or "",
+        }
+
+    
+    def get_export_pool_settings(self) -> Dict[str, int]:
+        """
+        Get process pool settings for large YOLO batch exports.
+        
+        Returns:
+            Dictionary with "min_annotations" and "workers" (0 means min(4, CPU count)).
+        """
+        return {
+            "min_annotations": int(self.get("export.process_pool_min_annotations", 50000)),
+            "workers": int(self.get("export.process_pool_workers", 0)),
+        }
+
+    
+    def get_batching_settings(self) -> Dict[str, Any]:
+        """
+        Get micro-batching settings for concurrent YOLOE requests.
+        
+        Returns:
+            Dictionary with "enabled", "max_batch" and "max_wait_ms".
+        """
+        return {
+            "enabled": bool(self.get("batching.enabled", True)),
+            "max_batch": int(self.get("batching.max_batch", 16)),
+            "max_wait_ms": float(self.get("batching.max_wait_ms", 5)),
+        }
 
 
 # Create global configuration instance
@@ -11,9 +11,13 @@ Author: EurekAnno Team
 Date: 2025-05-25
 """
 
+import collections
+import concurrent.futures
+import hashlib
 import os
 import re
-from typing import List, Dict, Any, Optional, Union, Tuple
+import threading
+from typing import List, Dict, Any, Iterator, Optional, Sequence, Union, Tuple
 from PIL import Image
 import torch
 import numpy as np
@@ -32,9 +36,36 @@ if not MOONDREAM_MODEL_PATH or not os.path.exists(MOONDREAM_MODEL_PATH):
     else:
         MOONDREAM_MODEL_PATH = None  # 允许在没有模型的情况下定义接口
 
+# 允许 Ampere 及以上 GPU 对剩余的 FP32 矩阵乘/卷积使用 TF32 张量核心
+torch.backends.cuda.matmul.allow_tf32 = True
+torch.backends.cudnn.allow_tf32 = True
+
+# 可选：xxhash 计算图像内容哈希更快，缺失时回退到 hashlib.blake2b
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# 图像编码缓存的默认容量（条目数）
+# 缓存的 encode_image 输出常驻显存：2025 版检查点中每条还带有图像前缀在文本模型各层的
+# K/V 副本，2B 模型约 140 MB/条，因此只保留最近的少数几张图像（同一图像连续走多种模式的场景）。
+# 启用缓存后每次调用（包括未命中）都要对完整像素缓冲区做一次哈希
+ENCODE_CACHE_SIZE = 2
+
+# 边界框输出格式: <click>x1, y1</click><click>x2, y2</click> 或 [x1, y1, x2, y2]
+_BBOX_RE = re.compile(
+    r'<click>(\d+),\s*(\d+)</click><click>(\d+),\s*(\d+)</click>|\[(\d+),\s*(\d+),\s*(\d+),\s*(\d+)\]'
+)
+
+# 图像预处理（读取/解码/转 RGB）线程数
+PREPROCESS_WORKERS = 4
+
+# 支持的 bitsandbytes 量化方式
+QUANTIZATION_MODES = ("none", "int8", "nf4", "fp8")
+
 # 尝试导入 transformers
 try:
-    from transformers import AutoModelForCausalLM, AutoTokenizer
+    from transformers import AutoModelForCausalLM, AutoTokenizer, GenerationConfig
     TRANSFORMERS_AVAILABLE = True
 except ImportError:
     TRANSFORMERS_AVAILABLE = False
@@ -52,8 +83,8 @@ class MoondreamInference:
     - answer: 回答关于图像的自由形式问题
     
     使用示例:
-        # 初始化模型
-        model = MoondreamInference()
+        # 初始化模型（服务场景请使用 get_shared()，避免重复加载数 GB 的权重）
+        model = MoondreamInference.get_shared()
         
         # 描述模式
         result = model.describe(image)
@@ -68,18 +99,68 @@ class MoondreamInference:
         result = model.answer(image, "How many people are in this image?")
     """
     
-    def __init__(self, model_path: str = MOONDREAM_MODEL_PATH, compile: bool = False):
+    # 进程内共享实例
+    _instance: Optional["MoondreamInference"] = None
+    _instance_lock = threading.Lock()
+    
+    @classmethod
+    def get_shared(cls, **kwargs) -> "MoondreamInference":
+        """
+        获取进程内共享的模型实例，首次调用时创建
+        
+        服务场景应使用此方法而不是每次请求构造新实例。参数仅在首次创建时生效。
+        
+        Args:
+            **kwargs: 传给构造函数的参数（如 compile）
+            
+        Returns:
+            共享的 MoondreamInference 实例
+        """
+        instance = cls._instance
+        if instance is None:
+            with cls._instance_lock:
+                instance = cls._instance
+                if instance is None:
+                    instance = cls(**kwargs)
+                    cls._instance = instance
+        return instance
+    
+    def __init__(self, model_path: str = MOONDREAM_MODEL_PATH, compile: bool = False,
+                 encode_cache_size: int = ENCODE_CACHE_SIZE,
+                 quantization: Optional[str] = None):
         """
         初始化 Moondream 推理模型
         
         Args:
             model_path: 模型路径
             compile: 是否编译模型以加速推理（默认为 False）
+            encode_cache_size: 图像编码 LRU 缓存容量，0 表示禁用；每条约占 140 MB 显存（2B 模型）
+            quantization: 量化方式 "none" / "int8" / "nf4"（bitsandbytes）/ "fp8"（torchao），
+                          默认读取配置 models.moondream.quantization
         """
+        if quantization is None:
+            quantization = config.get_moondream_quantization()
+        if quantization not in QUANTIZATION_MODES:
+            raise ValueError(
+                f"Unsupported quantization '{quantization}'. Expected one of: {', '.join(QUANTIZATION_MODES)}"
+            )
         self.model_path = model_path
         self.compile = compile
+        self.quantization = quantization
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         
+        # 同一张图像在多种模式间复用时跳过视觉编码器；FastAPI 工作线程共享实例，需加锁
+        self._encode_cache_size = max(0, int(encode_cache_size))
+        self._encode_cache: "collections.OrderedDict[Tuple, Any]" = collections.OrderedDict()
+        self._encode_cache_lock = threading.Lock()
+        
+        # 批量接口使用的预处理线程池，首次使用时创建
+        self._preprocess_pool: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._preprocess_pool_lock = threading.Lock()
+        
+        # 所有模式共用的生成配置（模型加载成功后创建）
+        self.generation_config = None
+        
         # 加载模型和分词器
         self._load_model()
         
@@ -98,32 +179,244 @@ class MoondreamInference:
             return
             
         try:
-            # 加载分词器
+            # 加载分词器（优先使用 Rust 实现的快速分词器）
             self.tokenizer = AutoTokenizer.from_pretrained(
                 self.model_path,
-                trust_remote_code=True
+                trust_remote_code=True,
+                use_fast=True
             )
             
             # 加载模型
-            self.model = AutoModelForCausalLM.from_pretrained(
-                self.model_path,
-                trust_remote_code=True,
-                torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
-                device_map="auto" if torch.cuda.is_available() else None
-            )
+            # device_map="auto" 会安装 accelerate 钩子，每次前向都有额外的 Python 调度开销，
+            # 仅在多 GPU 切分模型时使用；单 GPU 直接整体移动到设备上
+            load_kwargs = {
+                "trust_remote_code": True,
+                "torch_dtype": torch.float16 if torch.cuda.is_available() else torch.float32,
+                "device_map": "auto" if torch.cuda.device_count() > 1 else None,
+            }
+            quantization_config = self._build_quantization_config()
+            if quantization_config is not None:
+                # bitsandbytes 自行管理权重精度，且量化模型不支持 .to()，需在加载时指定设备
+                load_kwargs.pop("torch_dtype")
+                load_kwargs["quantization_config"] = quantization_config
+                if load_kwargs["device_map"] is None:
+                    load_kwargs["device_map"] = {"": self.device}
+            if self.quantization == "fp8" and torch.cuda.is_available():
+                # FP8 仅量化权重，计算以 BF16 进行
+                load_kwargs["torch_dtype"] = torch.bfloat16
+            self.model = self._from_pretrained(load_kwargs)
+            if load_kwargs["device_map"] is None:
+                self.model.to(self.device)
+            if self.quantization == "fp8":
+                self._apply_fp8_quantization()
+            if torch.cuda.is_available():
+                self._apply_channels_last()
             
             # 设置模型为评估模式
             self.model.eval()
             
-            # 如果启用编译，编译模型
+            # 固定贪心解码配置：避免仓库自带配置启用采样，使编译后的图在请求间复用
+            pad_token_id = self.tokenizer.pad_token_id
+            if pad_token_id is None:
+                pad_token_id = self.tokenizer.eos_token_id
+            self.generation_config = GenerationConfig(
+                do_sample=False,
+                num_beams=1,
+                use_cache=True,
+                pad_token_id=pad_token_id
+            )
+            
+            # 如果启用编译，编译视觉编码器与文本模型，并预热以吸收首次编译开销
             if self.compile and hasattr(torch, 'compile'):
-                self.model = torch.compile(self.model)
+                if self._compile_model() and config.get_compile_settings()["warmup"]:
+                    self._warmup()
                 
         except Exception as e:
             print(f"Warning: Failed to load model: {str(e)}")
             self.model = None
             self.tokenizer = None
     
+    def _from_pretrained(self, load_kwargs: Dict[str, Any]):
+        """
+        加载模型并请求融合注意力实现
+        
+        优先使用 FlashAttention-2（已安装且在 CUDA 上时），否则使用 PyTorch SDPA。
+        远程代码不支持所请求的实现时，回退到模型默认的注意力实现。
+        """
+        attn_implementation = "sdpa"
+        if torch.cuda.is_available():
+            try:
+                import flash_attn  # noqa: F401
+                attn_implementation = "flash_attention_2"
+            except ImportError:
+                pass
+        
+        try:
+            return AutoModelForCausalLM.from_pretrained(
+                self.model_path,
+                attn_implementation=attn_implementation,
+                **load_kwargs
+            )
+        except (ValueError, TypeError, ImportError) as e:
+            print(f"Warning: attn_implementation={attn_implementation} not supported ({str(e)}), using default")
+            return AutoModelForCausalLM.from_pretrained(self.model_path, **load_kwargs)
+    
+    def _build_quantization_config(self):
+        """
+        构建 bitsandbytes 量化配置
+        
+        int8 / nf4 减少每次矩阵乘读取的权重字节数，解码阶段受显存带宽限制时可提升吞吐。
+        仅在 CUDA 可用且安装了 bitsandbytes 时生效，否则按原精度加载。
+        
+        Returns:
+            BitsAndBytesConfig 或 None
+        """
+        if self.quantization in ("none", "fp8"):
+            return None
+        if not torch.cuda.is_available():
+            print(f"Warning: {self.quantization} quantization requires CUDA, loading without it")
+            return None
+        try:
+            import bitsandbytes  # noqa: F401
+            from transformers import BitsAndBytesConfig
+        except ImportError:
+            print(f"Warning: bitsandbytes not available, loading without {self.quantization} quantization")
+            return None
+        
+        if self.quantization == "int8":
+            return BitsAndBytesConfig(load_in_8bit=True)
+        return BitsAndBytesConfig(
+            load_in_4bit=True,
+            bnb_4bit_quant_type="nf4",
+            bnb_4bit_compute_dtype=torch.float16
+        )
+    
+    def _apply_fp8_quantization(self):
+        """
+        使用 torchao 对线性层权重做 FP8 (e4m3) 仅权重量化
+        
+        权重读取带宽减半，动态范围优于 int8；矩阵乘仍以 BF16 计算。
+        需要 Ada/Hopper（SM 8.9+）GPU 与 torchao，不满足时保持原精度。
+        """
+        if not torch.cuda.is_available() or torch.cuda.get_device_capability() < (8, 9):
+            print("Warning: fp8 quantization requires an Ada/Hopper GPU, keeping original precision")
+            return
+        try:
+            from torchao.quantization import quantize_
+            try:
+                from torchao.quantization import Float8WeightOnlyConfig
+                fp8_config = Float8WeightOnlyConfig()
+            except ImportError:
+                # 旧版 torchao 的函数式接口
+                from torchao.quantization import float8_weight_only
+                fp8_config = float8_weight_only()
+        except ImportError:
+            print("Warning: torchao not available, keeping original precision")
+            return
+        
+        quantize_(self.model, fp8_config)
+    
+    def _apply_channels_last(self):
+        """
+        将模型中的卷积层权重转换为 channels_last（NHWC）内存布局
+        
+        Ampere 及以上 GPU 上 cuDNN 的 NHWC 卷积核可使用张量核心；卷积权重为 channels_last 时，
+        输出也会采用该布局。Moondream 的 SigLIP 视觉编码器以线性层做 patch 嵌入，
+        若模型中没有卷积层则不做任何改动。
+        """
+        conv_layers = [m for m in self.model.modules() if isinstance(m, torch.nn.Conv2d)]
+        for conv in conv_layers:
+            conv.to(memory_format=torch.channels_last)
+    
+    def _compile_model(self) -> bool:
+        """
+        使用 torch.compile 编译 encode_image / generate 实际调用的子模块
+        
+        Moondream 的 encode_image 调用 vision_encoder，generate 调用 text_model.generate，
+        二者都不经过顶层模型的 forward，因此编译顶层 forward 不会生效。这里分别替换
+        vision_encoder 与 text_model 的 forward：视觉编码器输入固定为 378x378，按静态形状编译，
+        reduce-overhead 模式会捕获 CUDA Graphs；文本模型解码时 KV 缓存长度逐步增长，
+        允许 dynamo 自动标记动态维度，避免每个 token 都重新编译。
+        
+        Returns:
+            是否至少编译了一个子模块
+        """
+        settings = config.get_compile_settings()
+        try:
+            import torch._dynamo as dynamo
+            dynamo.config.cache_size_limit = settings["cache_size_limit"]
+        except (ImportError, AttributeError):
+            pass
+        
+        compiled = []
+        vision_encoder = getattr(self.model, "vision_encoder", None)
+        if isinstance(vision_encoder, torch.nn.Module):
+            vision_encoder.forward = torch.compile(
+                vision_encoder.forward,
+                mode=settings["mode"],
+                fullgraph=False,
+                dynamic=False
+            )
+            compiled.append("vision_encoder")
+        text_model = getattr(self.model, "text_model", None)
+        if isinstance(text_model, torch.nn.Module):
+            text_model.forward = torch.compile(
+                text_model.forward,
+                mode=settings["mode"],
+                fullgraph=False,
+                dynamic=None
+            )
+            compiled.append("text_model")
+        
+        if not compiled:
+            print("Warning: Moondream model has no vision_encoder/text_model submodules, skipping torch.compile")
+            return False
+        print(f"Compiled Moondream submodules: {', '.join(compiled)}")
+        return True
+    
+    def _warmup(self):
+        """
+        用空白图像跑一次编码 + 短生成，触发已编译子模块的首次编译，
+        使其落在服务启动阶段而不是第一个真实请求上。不经过编码缓存。
+        
+        文本模型按动态形状编译，更长的提示或输出仍可能在首次遇到时触发少量重新编译。
+        """
+        try:
+            with torch.inference_mode():
+                encoded_image = self.model.encode_image(Image.new("RGB", (384, 384)))
+            self._generate(
+                encoded_image,
+                "Describe this image.",
+                max_new_tokens=8
+            )
+        except Exception as e:
+            print(f"Warning: Moondream warmup failed: {str(e)}")
+    
+    def _generate(self, encoded_image: Any, prompt: str, max_new_tokens: int) -> str:
+        """
+        使用固定的生成配置基于已编码图像生成文本
+        
+        Args:
+            encoded_image: model.encode_image 的输出
+            prompt: 文本提示
+            max_new_tokens: 最大生成 token 数
+            
+        Returns:
+            生成的文本
+        """
+        kwargs = {}
+        if self.generation_config is not None:
+            kwargs["generation_config"] = self.generation_config
+        # inference_mode 比 eval() 更彻底：不记录版本计数与视图追踪
+        with torch.inference_mode():
+            return self.model.generate(
+                encoded_image,
+                prompt,
+                tokenizer=self.tokenizer,
+                max_new_tokens=max_new_tokens,
+                **kwargs
+            )
+    
     def _prepare_image(self, image: Union[str, Image.Image, np.ndarray]) -> Image.Image:
         """
         准备图像输入
@@ -140,11 +433,15 @@ class MoondreamInference:
                 raise FileNotFoundError(f"Image file not found: {image}")
             image = Image.open(image).convert("RGB")
         elif isinstance(image, np.ndarray):
-            # 从 numpy 数组转换
-            image = Image.fromarray(image).convert("RGB")
+            # 从 numpy 数组转换；uint8 HxWx3 数组直接得到 RGB 图像，无需再 convert 复制一次
+            if image.dtype == np.uint8 and image.ndim == 3 and image.shape[2] == 3:
+                image = Image.fromarray(image)
+            else:
+                image = Image.fromarray(image).convert("RGB")
         elif isinstance(image, Image.Image):
-            # 确保是 RGB 格式
-            image = image.convert("RGB")
+            # 确保是 RGB 格式；已是 RGB 时直接使用，避免整图复制
+            if image.mode != "RGB":
+                image = image.convert("RGB")
         else:
             raise TypeError(
                 f"Unsupported image type: {type(image)}. "
@@ -153,6 +450,82 @@ class MoondreamInference:
             
         return image
     
+    @staticmethod
+    def _image_key(image: Image.Image) -> Tuple:
+        """
+        计算图像内容的缓存键（尺寸 + 模式 + 像素哈希）
+        """
+        data = image.tobytes()
+        if xxhash is not None:
+            digest = xxhash.xxh3_128_digest(data)
+        else:
+            digest = hashlib.blake2b(data, digest_size=16).digest()
+        return image.size, image.mode, digest
+    
+    def _encode(self, image: Image.Image) -> Any:
+        """
+        编码图像，命中缓存时直接返回已编码结果
+        
+        Args:
+            image: RGB 格式的 PIL Image
+            
+        Returns:
+            model.encode_image 的输出
+        """
+        if self._encode_cache_size == 0:
+            with torch.inference_mode():
+                return self.model.encode_image(image)
+        
+        key = self._image_key(image)
+        with self._encode_cache_lock:
+            encoded_image = self._encode_cache.get(key)
+            if encoded_image is not None:
+                self._encode_cache.move_to_end(key)
+                return encoded_image
+        
+        # 在锁外运行视觉编码器，避免阻塞其他请求的缓存查询
+        with torch.inference_mode():
+            encoded_image = self.model.encode_image(image)
+        
+        with self._encode_cache_lock:
+            self._encode_cache[key] = encoded_image
+            self._encode_cache.move_to_end(key)
+            while len(self._encode_cache) > self._encode_cache_size:
+                self._encode_cache.popitem(last=False)
+        return encoded_image
+    
+    def clear_encode_cache(self) -> None:
+        """清空图像编码缓存"""
+        with self._encode_cache_lock:
+            self._encode_cache.clear()
+    
+    def _prepare_images(self, images: Sequence[Union[str, Image.Image, np.ndarray]]) -> Iterator[Image.Image]:
+        """
+        在线程池中并行预处理多张图像，按输入顺序逐张产出
+        
+        后续图像的读取与解码与当前图像的 GPU 推理重叠进行。
+        
+        Args:
+            images: 图像路径、PIL Image 对象或 numpy 数组的序列
+            
+        Returns:
+            RGB 格式 PIL Image 的迭代器
+        """
+        with self._preprocess_pool_lock:
+            if self._preprocess_pool is None:
+                self._preprocess_pool = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=PREPROCESS_WORKERS,
+                    thread_name_prefix="moondream-preprocess"
+                )
+        futures = [self._preprocess_pool.submit(self._prepare_image, image) for image in images]
+        try:
+            for future in futures:
+                yield future.result()
+        finally:
+            # 提前退出（如推理异常）时取消尚未开始的预处理
+            for future in futures:
+                future.cancel()
+    
     def describe(self, image: Union[str, Image.Image, np.ndarray]) -> Dict[str, Any]:
         """
         描述模式：生成图像的详细描述
@@ -176,15 +549,26 @@ class MoondreamInference:
                 "description": "This is a test image with white background. [Mock response - model not loaded]"
             }
         
-        # 编码图像
-        encoded_image = self.model.encode_image(image)
+        # 编码图像（内容相同的图像复用缓存）
+        encoded_image = self._encode(image)
         
+        return self._describe_encoded(encoded_image)
+    
+    def _describe_encoded(self, encoded_image: Any) -> Dict[str, Any]:
+        """
+        基于已编码的图像生成描述
+        
+        Args:
+            encoded_image: model.encode_image 的输出
+            
+        Returns:
+            与 describe 相同格式的字典
+        """
         # 生成描述
         prompt = "Describe this image in detail."
-        description = self.model.generate(
+        description = self._generate(
             encoded_image,
             prompt,
-            tokenizer=self.tokenizer,
             max_new_tokens=512
         )
         
@@ -193,6 +577,18 @@ class MoondreamInference:
             "description": description
         }
     
+    def describe_batch(self, images: Sequence[Union[str, Image.Image, np.ndarray]]) -> List[Dict[str, Any]]:
+        """
+        批量描述模式：依次描述多张图像，图像预处理在线程池中流水线进行
+        
+        Args:
+            images: 输入图像序列
+            
+        Returns:
+            与 describe 返回格式相同的字典列表，顺序与输入一致
+        """
+        return [self.describe(image) for image in self._prepare_images(images)]
+    
     def ground(self, image: Union[str, Image.Image, np.ndarray], object_name: str) -> Dict[str, Any]:
         """
         定位模式：在图像中定位指定对象
@@ -221,15 +617,14 @@ class MoondreamInference:
                 "confidence": [0.9]
             }
         
-        # 编码图像
-        encoded_image = self.model.encode_image(image)
+        # 编码图像（内容相同的图像复用缓存）
+        encoded_image = self._encode(image)
         
         # 生成定位查询
         prompt = f"<ground>{object_name}"
-        response = self.model.generate(
+        response = self._generate(
             encoded_image,
             prompt,
-            tokenizer=self.tokenizer,
             max_new_tokens=128
         )
         
@@ -243,6 +638,20 @@ class MoondreamInference:
             "confidence": [0.9] * len(bboxes)  # Moondream 不提供置信度，使用默认值
         }
     
+    def ground_batch(self, images: Sequence[Union[str, Image.Image, np.ndarray]],
+                     object_name: str) -> List[Dict[str, Any]]:
+        """
+        批量定位模式：在多张图像中定位同一对象
+        
+        Args:
+            images: 输入图像序列
+            object_name: 要定位的对象名称
+            
+        Returns:
+            与 ground 返回格式相同的字典列表，顺序与输入一致
+        """
+        return [self.ground(image, object_name) for image in self._prepare_images(images)]
+    
     def point(self, 
               image: Union[str, Image.Image, np.ndarray], 
               point: Tuple[int, int], 
@@ -265,12 +674,40 @@ class MoondreamInference:
             }
         """
         image = self._prepare_image(image)
-        x, y = point
         
         # 验证坐标在图像范围内
-        width, height = image.size
+        self._check_point(point, image.size)
+        
+        return self._point(image, point, question)
+    
+    @staticmethod
+    def _check_point(point: Tuple[int, int], image_size: Tuple[int, int]) -> None:
+        """
+        验证点击坐标在图像范围内
+        """
+        x, y = point
+        width, height = image_size
         if not (0 <= x < width and 0 <= y < height):
             raise ValueError(f"Point ({x}, {y}) is outside image bounds ({width}, {height})")
+    
+    def _point(self,
+               image: Image.Image,
+               point: Tuple[int, int],
+               question: str,
+               encoded_image: Any = None) -> Dict[str, Any]:
+        """
+        对已预处理、已验证坐标的图像执行点击问答
+        
+        Args:
+            image: RGB 格式的 PIL Image
+            point: 点击坐标 (x, y)
+            question: 关于点击位置的问题
+            encoded_image: 可选的已编码图像，为 None 时自动编码
+            
+        Returns:
+            与 point 相同格式的字典
+        """
+        x, y = point
         
         # 如果模型不可用，返回模拟数据
         if self.model is None:
@@ -281,15 +718,15 @@ class MoondreamInference:
                 "answer": f"This is the pixel at position ({x}, {y}). [Mock response - model not loaded]"
             }
         
-        # 编码图像
-        encoded_image = self.model.encode_image(image)
+        # 编码图像（内容相同的图像复用缓存）
+        if encoded_image is None:
+            encoded_image = self._encode(image)
         
         # 生成带坐标的查询
         prompt = f"<point>{x}, {y}</point> {question}"
-        answer = self.model.generate(
+        answer = self._generate(
             encoded_image,
             prompt,
-            tokenizer=self.tokenizer,
             max_new_tokens=256
         )
         
@@ -300,6 +737,37 @@ class MoondreamInference:
             "answer": answer
         }
     
+    def point_many(self,
+                   image: Union[str, Image.Image, np.ndarray],
+                   points: Sequence[Tuple[int, int]],
+                   questions: Sequence[str]) -> List[Dict[str, Any]]:
+        """
+        多点点击模式：同一图像只编码一次，仅对每个点击位置运行文本解码
+        
+        Args:
+            image: 输入图像
+            points: 点击坐标列表 [(x, y), ...]
+            questions: 与 points 一一对应的问题列表
+            
+        Returns:
+            与 point 返回格式相同的字典列表，顺序与输入一致
+        """
+        if len(points) != len(questions):
+            raise ValueError(
+                f"Length of points ({len(points)}) must match length of questions ({len(questions)})"
+            )
+        image = self._prepare_image(image)
+        
+        # 先验证全部坐标，避免无效输入浪费一次编码
+        for point in points:
+            self._check_point(point, image.size)
+        
+        encoded_image = self._encode(image) if self.model is not None and points else None
+        return [
+            self._point(image, point, question, encoded_image=encoded_image)
+            for point, question in zip(points, questions)
+        ]
+    
     def answer(self, image: Union[str, Image.Image, np.ndarray], question: str) -> Dict[str, Any]:
         """
         问答模式：回答关于图像的自由形式问题
@@ -326,14 +794,13 @@ class MoondreamInference:
                 "answer": "This is a white background test image. [Mock response - model not loaded]"
             }
         
-        # 编码图像
-        encoded_image = self.model.encode_image(image)
+        # 编码图像（内容相同的图像复用缓存）
+        encoded_image = self._encode(image)
         
         # 生成答案
-        answer = self.model.generate(
+        answer = self._generate(
             encoded_image,
             question,
-            tokenizer=self.tokenizer,
             max_new_tokens=256
         )
         
@@ -343,6 +810,20 @@ class MoondreamInference:
             "answer": answer
         }
     
+    def answer_batch(self, images: Sequence[Union[str, Image.Image, np.ndarray]],
+                     question: str) -> List[Dict[str, Any]]:
+        """
+        批量问答模式：对多张图像回答同一问题
+        
+        Args:
+            images: 输入图像序列
+            question: 关于图像的问题
+            
+        Returns:
+            与 answer 返回格式相同的字典列表，顺序与输入一致
+        """
+        return [self.answer(image, question) for image in self._prepare_images(images)]
+    
     def _parse_bounding_boxes(self, response: str, image_size: Tuple[int, int]) -> List[List[float]]:
         """
         解析模型输出中的边界框坐标
@@ -355,34 +836,32 @@ class MoondreamInference:
             边界框坐标列表 [[x1, y1, x2, y2], ...]
         """
         width, height = image_size
-        bboxes = []
-        
-        # 使用正则表达式匹配坐标
-        # 期望格式: <click>x1, y1</click><click>x2, y2</click> 或 [x1, y1, x2, y2]
-        pattern = r'<click>(\d+),\s*(\d+)</click><click>(\d+),\s*(\d+)</click>|\[(\d+),\s*(\d+),\s*(\d+),\s*(\d+)\]'
-        matches = re.findall(pattern, response)
-        
-        for match in matches:
-            if match[0]:  # <click> 格式
-                x1, y1, x2, y2 = map(int, match[:4])
-            else:  # [x1, y1, x2, y2] 格式
-                x1, y1, x2, y2 = map(int, match[4:])
-            
-            # 确保坐标在图像范围内
-            x1 = max(0, min(x1, width))
-            y1 = max(0, min(y1, height))
-            x2 = max(0, min(x2, width))
-            y2 = max(0, min(y2, height))
-            
-            # 确保 x1 < x2 且 y1 < y2
-            if x1 > x2:
-                x1, x2 = x2, x1
-            if y1 > y2:
-                y1, y2 = y2, y1
-                
-            bboxes.append([x1, y1, x2, y2])
         
-        return bboxes
+        # 使用预编译的正则表达式逐个匹配坐标，直接流入 (N, 4) 数组，不生成中间匹配列表：
+        # <click> 格式取前四组，否则取后四组
+        boxes = np.fromiter(
+            (
+                int(v)
+                for match in _BBOX_RE.finditer(response)
+                for v in (match.group(1, 2, 3, 4) if match.group(1) else match.group(5, 6, 7, 8))
+            ),
+            dtype=np.int64
+        ).reshape(-1, 4)
+        if len(boxes) == 0:
+            return []
+        
+        # 确保坐标在图像范围内
+        np.clip(boxes[:, 0::2], 0, width, out=boxes[:, 0::2])
+        np.clip(boxes[:, 1::2], 0, height, out=boxes[:, 1::2])
+        
+        # 确保 x1 < x2 且 y1 < y2
+        bboxes = np.column_stack((
+            np.minimum(boxes[:, 0], boxes[:, 2]),
+            np.minimum(boxes[:, 1], boxes[:, 3]),
+            np.maximum(boxes[:, 0], boxes[:, 2]),
+            np.maximum(boxes[:, 1], boxes[:, 3]),
+        ))
+        return bboxes.tolist()
 
 
 if __name__ == "__main__":
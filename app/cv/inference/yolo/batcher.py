@@ -0,0 +1,137 @@
+import asyncio
+import logging
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrently arriving inference requests into batched model calls.
+
+    Requests are submitted with a hashable `key` describing everything that must
+    be identical for two requests to share a forward pass (model, mode, prompts,
+    thresholds, ...). A single consumer task collects requests for up to
+    `max_wait_ms` (or until `max_batch` requests are queued), groups them by key
+    and hands each group to `batch_fn` in a worker thread.
+
+    Groups are executed one at a time, so the underlying (stateful, non thread-safe)
+    model is never called concurrently.
+
+    Usage Example
+    =============
+
+    .. code-block:: python
+
+        def run(key, images):
+            model, conf = key
+            return model.predict(images, conf=conf)  # one result per image
+
+        batcher = MicroBatcher(run, max_batch=16, max_wait_ms=5)
+        result = await batcher.submit((model, 0.25), image)
+    """
+
+    def __init__(
+        self,
+        batch_fn: Callable[[Hashable, List[Any]], List[Any]],
+        max_batch: int = 16,
+        max_wait_ms: float = 5.0
+    ):
+        """
+        Args:
+            batch_fn: Blocking callable taking (key, items) and returning one result
+                      per item, in order. Runs in a worker thread.
+            max_batch: Maximum number of requests collected per batching window.
+            max_wait_ms: How long to wait for more requests after the first one arrives.
+        """
+        self.batch_fn = batch_fn
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    def _ensure_worker(self) -> asyncio.Queue:
+        # Created lazily so the queue and task bind to the running event loop
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+        return self._queue
+
+    async def submit(self, key: Hashable, item: Any) -> Any:
+        """
+        Queues `item` for batched execution and waits for its result.
+
+        Args:
+            key: Grouping key; only items with equal keys are batched together.
+            item: Per-request payload passed to `batch_fn`.
+
+        Returns:
+            The result produced by `batch_fn` for this item.
+        """
+        queue = self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await queue.put((key, item, future))
+        return await future
+
+    async def _collect(self) -> Dict[Hashable, List[Tuple[Any, asyncio.Future]]]:
+        """
+        Waits for one request, then gathers more until the window closes or the batch is full.
+        """
+        loop = asyncio.get_running_loop()
+        key, item, future = await self._queue.get()
+        groups: Dict[Hashable, List[Tuple[Any, asyncio.Future]]] = {key: [(item, future)]}
+        count = 1
+        deadline = loop.time() + self.max_wait
+        while count < self.max_batch:
+            try:
+                if self._queue.empty():
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    key, item, future = await asyncio.wait_for(self._queue.get(), timeout)
+                else:
+                    key, item, future = self._queue.get_nowait()
+            except asyncio.TimeoutError:
+                break
+            groups.setdefault(key, []).append((item, future))
+            count += 1
+        return groups
+
+    async def _run(self) -> None:
+        while True:
+            groups = await self._collect()
+            for key, entries in groups.items():
+                # Skip requests whose clients have already gone away
+                entries = [(item, future) for item, future in entries if not future.done()]
+                if not entries:
+                    continue
+                try:
+                    results = await asyncio.to_thread(self.batch_fn, key, [item for item, _ in entries])
+                    if len(results) != len(entries):
+                        raise RuntimeError(
+                            f"Batch returned {len(results)} results for {len(entries)} inputs."
+                        )
+                except Exception as e:
+                    logging.error(f"Batched inference failed: {e}")
+                    for _, future in entries:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                for (_, future), result in zip(entries, results):
+                    if not future.done():
+                        future.set_result(result)
+
+    async def close(self) -> None:
+        """
+        Stops the consumer task; pending requests are cancelled.
+        """
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        if self._queue is not None:
+            while not self._queue.empty():
+                _, _, future = self._queue.get_nowait()
+                future.cancel()
+            self._queue = None
@@ -1,8 +1,22 @@
+import functools
+import logging
 import os
+import shutil
 import sys
 import cv2
 import numpy as np
-from typing import List, Union, Optional, Dict, Any
+import torch
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import List, Union, Optional, Dict, Any, Tuple
+
+# Opt-in: serve torch.load() from shared memory so multiple server workers load the
+# checkpoints once. Must patch torch.load before Ultralytics is imported.
+if os.environ.get("EUREKANNO_OVERMIND_CACHE", "").lower() in ("1", "true", "yes"):
+    try:
+        import overmind.api
+        overmind.api.monkey_patch_all()
+    except ImportError:
+        logging.warning("EUREKANNO_OVERMIND_CACHE is set but overmind-cache is not installed.")
 
 from ultralytics import YOLO
 from ultralytics.models.yolo.yoloe import YOLOEVPSegPredictor
@@ -10,23 +24,72 @@ from ultralytics.models.yolo.yoloe import YOLOEVPSegPredictor
 # Import config
 try:
     from app.config import config
-    # Get model paths from config
+    # Configured model paths; validated lazily by _resolve_model_paths()
     YOLOE_SEG_PATH = config.get_yoloe_seg_path()
     YOLOE_SEG_PF_PATH = config.get_yoloe_seg_pf_path()
-    
-    # Check if paths are provided and valid
-    if not YOLOE_SEG_PATH or not os.path.exists(YOLOE_SEG_PATH):
-        print(f"Warning: YOLOE-SEG model path not found or invalid: {YOLOE_SEG_PATH}. Using default.")
-        YOLOE_SEG_PATH = "yoloe-11s-seg.pt"
-        
-    if not YOLOE_SEG_PF_PATH or not os.path.exists(YOLOE_SEG_PF_PATH):
-        print(f"Warning: YOLOE-SEG-PF model path not found or invalid: {YOLOE_SEG_PF_PATH}. Using default.")
-        YOLOE_SEG_PF_PATH = "yoloe-11l-seg-pf.pt"
+    # Optional TensorRT engine for the prompt-free model (prompted modes need the
+    # PyTorch model to embed text/visual prompts, so they always use the .pt)
+    YOLOE_SEG_PF_ENGINE_PATH = config.get_yoloe_engine_path()
+    YOLOE_AUTO_EXPORT_ENGINE = config.get_yoloe_auto_export_engine()
+    YOLOE_PRECISION = config.get_yoloe_precision()
+    YOLOE_CALIBRATION_DATA = config.get_yoloe_calibration_data()
+    YOLOE_ENGINE_CACHE_DIR = config.get_yoloe_engine_cache_dir()
+    YOLOE_COMPILE = config.get_yoloe_compile()
+    COMPILE_SETTINGS = config.get_compile_settings()
         
 except ImportError:
-    print("Warning: Could not import configuration. Using default model paths.")
-    YOLOE_SEG_PATH = "yoloe-11s-seg.pt"
-    YOLOE_SEG_PF_PATH = "yoloe-11l-seg-pf.pt"
+    logging.warning("Could not import configuration. Using default model paths.")
+    YOLOE_SEG_PATH = ""
+    YOLOE_SEG_PF_PATH = ""
+    YOLOE_SEG_PF_ENGINE_PATH = ""
+    YOLOE_AUTO_EXPORT_ENGINE = False
+    YOLOE_PRECISION = "fp16"
+    YOLOE_CALIBRATION_DATA = ""
+    YOLOE_ENGINE_CACHE_DIR = ""
+    YOLOE_COMPILE = False
+    COMPILE_SETTINGS = {"mode": "reduce-overhead", "cache_size_limit": 128,
+                        "warmup": True, "inductor_cache_dir": ""}
+
+# Ultralytics downloads these weights when no local path is configured
+DEFAULT_YOLOE_SEG = "yoloe-11s-seg.pt"
+DEFAULT_YOLOE_SEG_PF = "yoloe-11l-seg-pf.pt"
+
+
+@functools.lru_cache(maxsize=None)
+def _resolve_model_paths() -> Tuple[str, str, str]:
+    """
+    Validates the configured model paths on first use, falling back to the
+    downloadable defaults. Runs once per process, and only when a default
+    model is actually loaded, so importing this module does not stat the
+    (possibly network-mounted) weights directory.
+
+    Returns:
+        (seg_path, seg_pf_path, engine_path); engine_path is "" when no
+        prebuilt engine is configured.
+    """
+    seg_path, seg_pf_path, engine_path = YOLOE_SEG_PATH, YOLOE_SEG_PF_PATH, YOLOE_SEG_PF_ENGINE_PATH
+
+    if not seg_path or not os.path.exists(seg_path):
+        logging.warning(f"YOLOE-SEG model path not found or invalid: {seg_path}. Using default.")
+        seg_path = DEFAULT_YOLOE_SEG
+
+    if not seg_pf_path or not os.path.exists(seg_pf_path):
+        logging.warning(f"YOLOE-SEG-PF model path not found or invalid: {seg_pf_path}. Using default.")
+        seg_pf_path = DEFAULT_YOLOE_SEG_PF
+
+    if engine_path and not os.path.exists(engine_path):
+        logging.warning(f"YOLOE engine not found: {engine_path}. Using {seg_pf_path}.")
+        engine_path = ""
+
+    return seg_path, seg_pf_path, engine_path
+
+
+# Largest batch a dynamically shaped TensorRT engine is built for (matches the micro-batcher)
+ENGINE_MAX_BATCH = 16
+
+# Allow TF32 tensor cores for any remaining fp32 matmuls/convolutions (Ampere+)
+torch.backends.cuda.matmul.allow_tf32 = True
+torch.backends.cudnn.allow_tf32 = True
 
 
 class YOLOE:
@@ -90,7 +153,19 @@ class YOLOE:
         print(result_json)
     """
 
-    def __init__(self, model_path: str = "default"):
+    # Images per forward pass in batch_predict; larger batches mostly add memory pressure
+    OPTIMAL_BATCH = 16
+
+    # Text-prompt embeddings kept per class list; the oldest entry is evicted first
+    TEXT_PE_CACHE_SIZE = 64
+
+    # Background threads that write visualizations to disk, shared by all instances
+    _writer = ThreadPoolExecutor(max_workers=2, thread_name_prefix="yoloe-writer")
+    # JPEG quality for saved visualizations (OpenCV's default is 95)
+    VISUALIZE_JPEG_QUALITY = 85
+
+    def __init__(self, model_path: str = "default", half: Optional[bool] = None,
+                 precision: Optional[str] = None):
         """
         Initializes a YOLOE model.
         
@@ -99,20 +174,37 @@ class YOLOE:
                 Path to the YOLOE model weights (e.g. "yoloe-11s-seg.pt") or
                 "default" to use our mode-switching logic with default
                 models for prompt-free vs. text/image-prompted modes.
+            half (Optional[bool]):
+                Run inference in FP16. Defaults to True when CUDA is available
+                and the precision is "fp16" or "int8".
+            precision (Optional[str]):
+                "fp32", "fp16" or "int8"; defaults to models.yoloe.precision.
+                "int8" only affects the TensorRT engine of the prompt-free model
+                (see `_ensure_engine`); PyTorch models then run in FP16.
         """
+        self.precision = (precision or YOLOE_PRECISION).lower()
+        if half is None:
+            half = torch.cuda.is_available() and self.precision in ("fp16", "int8")
+        self.half = half
         self.current_mode = "prompt-free"
         self.class_names: Optional[List[str]] = None
         self.embeddings: Optional[np.ndarray] = None
 
+        # Default models that have been loaded, keyed by slot ("prompt-free" / "prompted")
+        self._models: Dict[str, YOLO] = {}
+        # Text-prompt embeddings keyed by the class names they were computed for
+        self._pe_cache: Dict[Tuple[str, ...], Any] = {}
+        # Visualization writes that may still be in flight
+        self._pending_writes: List[Future] = []
+
         if model_path == "default":
             # Keep self.model_path as 'default' but load the correct
             # "prompt-free" model for initial usage.
-            initial_path = self._get_default_model_path()
-            self.model = YOLO(initial_path)
+            self.model = self._load_mode(self.current_mode)
             self.model_path = "default"
         else:
             # Load a custom or user-specified model path
-            self.model = YOLO(model_path)
+            self.model = self._maybe_compile(YOLO(model_path))
             self.model_path = model_path
 
     def _get_default_model_path(self) -> str:
@@ -124,10 +216,201 @@ class YOLOE:
 
         Modify these paths to your absolute paths if needed.
         """
+        seg_path, seg_pf_path, _ = _resolve_model_paths()
         if self.current_mode == "prompt-free":
-            return YOLOE_SEG_PF_PATH
+            return seg_pf_path
+        else:
+            return seg_path
+
+    @staticmethod
+    def _engine_cache_path(pt_path: str, precision: str) -> str:
+        """
+        Returns where the engine built from `pt_path` is cached on this machine.
+
+        TensorRT engines only run on the GPU architecture and TensorRT version
+        they were built with, so the file name carries both (and the
+        precision: "fp32", "fp16" or "int8"), e.g.
+        "yoloe-11l-seg-pf.sm89.trt10.3.0.fp16.engine". The file lives in
+        engine_cache_dir (which may be a volume shared by workers and hosts
+        with the same GPU), or next to the weights when that is not set.
+        """
+        major, minor = torch.cuda.get_device_capability()
+        key = f"sm{major}{minor}"
+        try:
+            import tensorrt
+            key += f".trt{tensorrt.__version__}"
+        except ImportError:
+            pass
+        key += f".{precision}"
+
+        stem = os.path.splitext(os.path.basename(pt_path))[0]
+        cache_dir = YOLOE_ENGINE_CACHE_DIR or os.path.dirname(os.path.abspath(pt_path))
+        return os.path.join(cache_dir, f"{stem}.{key}.engine")
+
+    def _ensure_engine(self, pt_path: str) -> str:
+        """
+        Returns the TensorRT engine to load in place of `pt_path`, if there is one.
+
+        Uses the configured engine, else the cached engine for this GPU and
+        TensorRT version (see `_engine_cache_path`), else a hand-placed sibling
+        "<name>.engine" ("<name>.int8.engine" at int8 precision). When none
+        exists and auto_export_engine is enabled, the engine is exported once
+        and stored at the cache path. INT8 export needs calibration_data;
+        without it the FP16 engine is used instead. Without CUDA (or if export
+        fails) `pt_path` is returned.
+
+        Args:
+            pt_path (str): Path to the PyTorch weights.
+
+        Returns:
+            (str): Path to the engine file, or `pt_path`.
+        """
+        _, seg_pf_path, configured_engine = _resolve_model_paths()
+        if configured_engine and pt_path == seg_pf_path:
+            return configured_engine
+        if not torch.cuda.is_available():
+            return pt_path
+
+        int8 = self.precision == "int8"
+        if int8 and not YOLOE_CALIBRATION_DATA:
+            logging.warning("INT8 precision needs models.yoloe.calibration_data. Using an FP16 engine.")
+            int8 = False
+
+        precision = "int8" if int8 else ("fp16" if self.half else "fp32")
+        cache_path = self._engine_cache_path(pt_path, precision)
+        if os.path.exists(cache_path):
+            return cache_path
+        sibling_path = os.path.splitext(pt_path)[0] + (".int8.engine" if int8 else ".engine")
+        if os.path.exists(sibling_path):
+            return sibling_path
+        if not YOLOE_AUTO_EXPORT_ENGINE:
+            return pt_path
+
+        export_args = dict(format="engine", dynamic=True, batch=ENGINE_MAX_BATCH, workspace=4)
+        if int8:
+            export_args.update(int8=True, data=YOLOE_CALIBRATION_DATA)
+        else:
+            export_args.update(half=self.half)
+        try:
+            exported = YOLO(pt_path).export(**export_args)
+            if not exported:
+                return pt_path
+            # Ultralytics writes "<name>.engine" next to the weights; move it into
+            # the cache under its keyed name. Write to a temporary name first so
+            # other workers never load a partially copied engine.
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            shutil.move(str(exported), tmp_path)
+            os.replace(tmp_path, cache_path)
+        except Exception as e:
+            logging.warning("TensorRT export of %s failed: %s. Using PyTorch weights.", pt_path, e)
+            return pt_path
+        return cache_path
+
+    def _load_default_model(self, mode: str) -> YOLO:
+        """
+        Loads the default model for `mode`. 'prompt-free' mode uses a TensorRT
+        engine when one is available (see `_ensure_engine`); prompted modes need
+        the PyTorch model to embed text/visual prompts.
+        """
+        seg_path, seg_pf_path, _ = _resolve_model_paths()
+        if mode == "prompt-free":
+            path = self._ensure_engine(seg_pf_path)
+            if path.endswith(".engine"):
+                return YOLO(path, task="segment")
+            return self._maybe_compile(YOLO(path))
+        return self._maybe_compile(YOLO(seg_path))
+
+    @staticmethod
+    def _maybe_compile(model: YOLO) -> YOLO:
+        """
+        Arranges for the network run by `model`'s predictors to be wrapped in
+        torch.compile when models.yoloe.compile is enabled and CUDA is available.
+
+        Ultralytics builds its predictor lazily and wraps the network in an
+        AutoBackend that fuses it, which would drop a compiled wrapper set on
+        `model.model` beforehand. So the compile happens in an
+        "on_predict_start" callback, once the predictor's AutoBackend exists;
+        exported models (e.g. TensorRT engines) are left alone.
+
+        Kernels are cached under compile.inductor_cache_dir when it is set, so
+        only the first worker to compile a model pays the full compile time.
+        """
+        if not (YOLOE_COMPILE and torch.cuda.is_available() and hasattr(torch, "compile")):
+            return model
+        if not isinstance(model.model, torch.nn.Module):
+            return model
+
+        if COMPILE_SETTINGS["inductor_cache_dir"]:
+            os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", COMPILE_SETTINGS["inductor_cache_dir"])
+        try:
+            import torch._dynamo
+            torch._dynamo.config.cache_size_limit = COMPILE_SETTINGS["cache_size_limit"]
+        except (ImportError, AttributeError):
+            pass
+
+        model.add_callback("on_predict_start", YOLOE._compile_predictor_model)
+        model.add_callback("on_predict_end", YOLOE._check_compiled_graphs)
+        return model
+
+    @staticmethod
+    def _compile_predictor_model(predictor) -> None:
+        """
+        "on_predict_start" callback: wraps the network inside the predictor's
+        AutoBackend in torch.compile (once per AutoBackend).
+        """
+        backend = predictor.model
+        if getattr(backend, "_yoloe_compiled", False):
+            return
+        backend._yoloe_compiled = True
+        if not getattr(backend, "pt", False) or not isinstance(getattr(backend, "model", None), torch.nn.Module):
+            return
+        try:
+            # Batch size and letterboxed image size vary between calls
+            backend.model = torch.compile(backend.model, mode=COMPILE_SETTINGS["mode"], dynamic=True)
+            logging.info("torch.compile enabled for the YOLOE %s model", type(predictor).__name__)
+        except Exception as e:
+            logging.warning("torch.compile of the YOLOE model failed: %s. Running eagerly.", e)
+
+    @staticmethod
+    def _check_compiled_graphs(predictor) -> None:
+        """
+        "on_predict_end" callback: after the first compiled prediction, logs
+        how many graphs dynamo actually compiled, and warns if there were none
+        (the model is then still running eagerly).
+        """
+        backend = predictor.model
+        if not getattr(backend, "_yoloe_compiled", False) or getattr(backend, "_yoloe_compile_checked", False):
+            return
+        backend._yoloe_compile_checked = True
+        if not hasattr(backend.model, "_orig_mod"):
+            return
+        try:
+            from torch._dynamo.utils import counters
+            graphs = counters["stats"]["unique_graphs"]
+        except (ImportError, AttributeError, KeyError):
+            return
+        if graphs:
+            logging.info("torch.compile: %d graph(s) compiled for the YOLOE model", graphs)
         else:
-            return YOLOE_SEG_PATH
+            logging.warning("torch.compile compiled no graphs for the YOLOE model; it is running eagerly.")
+
+    def _load_mode(self, mode: str) -> YOLO:
+        """
+        Returns the default model for `mode`, loading it on first use.
+
+        Text- and image-prompted modes share the standard YOLOE model, so at most
+        two models (prompt-free and prompted) are kept in memory.
+
+        Args:
+            mode (str): One of ["prompt-free", "text-prompted", "image-prompted"].
+        """
+        slot = "prompt-free" if mode == "prompt-free" else "prompted"
+        model = self._models.get(slot)
+        if model is None:
+            model = self._load_default_model(mode)
+            self._models[slot] = model
+        return model
 
     def _switch_to_mode(self, mode: str) -> None:
         """
@@ -140,29 +423,61 @@ class YOLOE:
         previous_mode = self.current_mode
         self.current_mode = mode
 
-        if self.model_path == "default":
-            # If we are switching between prompt-free and a prompted mode,
-            # reload the corresponding default model.
-            if previous_mode == "prompt-free" and mode in ["text-prompted", "image-prompted"]:
-                self.model = YOLO(self._get_default_model_path())
-            elif previous_mode in ["text-prompted", "image-prompted"] and mode == "prompt-free":
-                self.model = YOLO(self._get_default_model_path())
+        if self.model_path == "default" and mode != previous_mode:
+            # Both default models stay resident, so switching is a pointer swap
+            self.model = self._load_mode(mode)
 
-    def _preprocess_source(self, source: Union[str, List[str]]) -> Union[str, List[str]]:
+    def _get_text_pe(self, class_names: List[str]) -> Any:
         """
-        Preprocesses the `source` (image path or list of image paths) for YOLO inference.
-        
+        Returns the text-prompt embeddings for `class_names`, running the text
+        encoder only the first time a given class list is seen.
+
         Args:
-            source (Union[str, List[str]]): file path or list of file paths.
-            
+            class_names (List[str]): Class strings to embed.
+
         Returns:
-            (Union[str, List[str]]): The same input or a processed variant (if needed).
+            The embeddings returned by `get_text_pe` of the prompted model.
         """
-        if isinstance(source, list):
-            return source
-        return source  # Single path as-is
-        
-    def _convert_results_to_summary_dict(self, results: List[Any]) -> Dict[str, List[Any]]:
+        key = tuple(class_names)
+        embeddings = self._pe_cache.get(key)
+        if embeddings is None:
+            embeddings = self.model.get_text_pe(list(key))
+            if len(self._pe_cache) >= self.TEXT_PE_CACHE_SIZE:
+                self._pe_cache.pop(next(iter(self._pe_cache)))
+            self._pe_cache[key] = embeddings
+        return embeddings
+
+    def _preprocess_source(
+        self,
+        source: Union[str, np.ndarray, torch.Tensor, List[Union[str, np.ndarray]]]
+    ) -> Union[str, np.ndarray, torch.Tensor, List[Union[str, np.ndarray]]]:
+        """
+        Normalizes the `source` for YOLO inference without touching the pixels.
+
+        Paths and lists of paths are passed through for Ultralytics to load.
+        Already-decoded BGR arrays (HxWx3, or a list of them) skip the file
+        loader entirely; an NxHxWx3 array is split into a list of per-image
+        views (no copy) since Ultralytics treats a single array as one image.
+        A BCHW float tensor in [0, 1] is returned as-is, so frames already on
+        the GPU stay there; a single CHW tensor gets a batch dimension.
+
+        Args:
+            source: File path(s), decoded image array(s), or an image tensor.
+
+        Returns:
+            The source in a form `model.predict` accepts.
+        """
+        if isinstance(source, np.ndarray) and source.ndim == 4:
+            return list(source)
+        if isinstance(source, torch.Tensor) and source.ndim == 3:
+            return source.unsqueeze(0)
+        return source
+
+    def _convert_results_to_summary_dict(
+        self,
+        results: List[Any],
+        include_masks: bool = True
+    ) -> Dict[str, List[Any]]:
         """
         Converts Ultralytics 'Results' objects into a single dictionary:
             {
@@ -174,6 +489,8 @@ class YOLOE:
         
         Args:
             results (List[Any]): A list of Ultralytics Results objects.
+            include_masks (bool): If False, mask polygons are not extracted and
+                                  "masks" holds None for every detection.
             
         Returns:
             Dict[str, List[Any]]: A single dict merging all detections from
@@ -186,39 +503,69 @@ class YOLOE:
             "masks": [],
         }
 
-        # Each 'Results' object in `results` corresponds to a single image
+        # Each 'Results' object in `results` corresponds to a single image.
+        # `results` may be a generator (stream=True), so images are folded in
+        # one at a time and never held in memory together.
         for res in results:
-            # If there are bounding boxes:
-            if res.boxes is not None and len(res.boxes) > 0:
-                class_ids = res.boxes.cls.cpu().numpy().astype(int)
-                confidences = res.boxes.conf.cpu().numpy()
-                bboxes = res.boxes.xyxy.cpu().numpy()
-                
-                # If there are masks (segmentation):
-                mask_xy = None
-                if res.masks is not None:
-                    mask_xy = res.masks.xy  # list of arrays
-
-                for i, class_id in enumerate(class_ids):
-                    # Class name
-                    if hasattr(res, "names") and res.names is not None and class_id in res.names:
-                        class_name = res.names[class_id]
-                    else:
-                        class_name = f"class_{class_id}"
-                    
-                    summary["class"].append(class_name)
-                    summary["confidence"].append(float(confidences[i]))
-                    summary["bbox"].append(bboxes[i].tolist())
-                    
-                    # If segmentation mask is present, store it
-                    if mask_xy is not None and i < len(mask_xy):
-                        # mask_xy[i] is an Nx2 array of polygon points
-                        summary["masks"].append(mask_xy[i].tolist())
-                    else:
-                        summary["masks"].append(None)
+            self._fold_result(summary, res, include_masks)
 
         return summary
 
+    @staticmethod
+    def _fold_result(summary: Dict[str, List[Any]], res: Any, include_masks: bool = True) -> None:
+        """
+        Appends the detections of one Ultralytics Results object (one image)
+        to the lists of `summary`, in place.
+
+        Args:
+            summary (Dict[str, List[Any]]): Dict with "class", "confidence", "bbox", "masks" lists.
+            res (Any): An Ultralytics Results object.
+            include_masks (bool): If False, "masks" gets None for every detection.
+        """
+        # If there are bounding boxes:
+        if res.boxes is not None and len(res.boxes) > 0:
+            # boxes.data packs [x1, y1, x2, y2, (track_id,) conf, cls] per row:
+            # copy it to host in a single transfer and slice on the CPU
+            packed = res.boxes.data.cpu().numpy()
+            bboxes = packed[:, :4]
+            confidences = packed[:, -2]
+            class_ids = packed[:, -1].astype(int).tolist()
+            num_detections = len(class_ids)
+
+            # Class names, resolved in one pass
+            names = getattr(res, "names", None) or {}
+            summary["class"].extend(
+                names[class_id] if class_id in names else f"class_{class_id}"
+                for class_id in class_ids
+            )
+            # Bulk conversion of whole arrays instead of per-detection indexing
+            summary["confidence"].extend(confidences.tolist())
+            summary["bbox"].extend(bboxes.tolist())
+
+            # If there are masks (segmentation), store each Nx2 polygon;
+            # detections without a mask get None
+            mask_xy = res.masks.xy if include_masks and res.masks is not None else []
+            num_masks = min(num_detections, len(mask_xy))
+            summary["masks"].extend(mask_xy[i].tolist() for i in range(num_masks))
+            summary["masks"].extend([None] * (num_detections - num_masks))
+
+    def results_to_dict(self, results: List[Any], include_masks: bool = True) -> Dict[str, List[Any]]:
+        """
+        Converts raw Ultralytics Results (as returned with return_dict=False)
+        into the same summary dictionary that return_dict=True produces.
+
+        Lets callers that need both the raw Results (e.g. for plotting) and the
+        JSON summary run inference only once.
+
+        Args:
+            results (List[Any]): A list of Ultralytics Results objects.
+            include_masks (bool): If False, skip mask polygon extraction (masks are None).
+
+        Returns:
+            Dict[str, List[Any]]: Summary dict with "class", "confidence", "bbox", "masks".
+        """
+        return self._convert_results_to_summary_dict(results, include_masks)
+
     def reset_to_prompt_free(self) -> None:
         """
         Resets the model to 'prompt-free' mode and reloads the default
@@ -239,7 +586,7 @@ class YOLOE:
         self._switch_to_mode("text-prompted")
         # Get embeddings for the new text prompts
         self.class_names = class_names
-        self.embeddings = self.model.get_text_pe(class_names)
+        self.embeddings = self._get_text_pe(class_names)
         self.model.set_classes(class_names, self.embeddings)
 
     def predict(
@@ -247,12 +594,15 @@ class YOLOE:
         source: Union[str, List[str]],
         conf: float = 0.25,
         iou: float = 0.7,
+        max_det: int = 100,
+        agnostic_nms: bool = True,
         save: bool = False,
         save_dir: Optional[str] = None,
         mode: Optional[str] = None,
         prompt: Optional[Union[List[str], Dict[str, np.ndarray]]] = None,
         refer_image: Optional[Union[str, np.ndarray]] = None,
         return_dict: bool = True,
+        include_masks: bool = True,
         **kwargs
     ) -> Union[Dict[str, List[Any]], List[Any]]:
         """
@@ -261,7 +611,12 @@ class YOLOE:
         Args:
             source: File path or list of file paths to images.
             conf: Confidence threshold (0.0-1.0).
-            iou: IoU threshold for non-max suppression (0.0-1.0).
+            iou: IoU threshold for non-max suppression (0.0-1.0). Avoid near-zero
+                 values: NMS cost grows sharply as the threshold approaches 0.
+            max_det: Maximum detections kept per image after NMS. Fewer kept boxes
+                     means less data copied back from the GPU.
+            agnostic_nms: Run class-agnostic NMS, so overlapping boxes of different
+                          classes are suppressed together.
             save: Whether to save annotated outputs to disk.
             save_dir: Directory in which to save outputs if save=True.
             mode: Override detection mode: "prompt-free", "text-prompted", or "image-prompted".
@@ -271,6 +626,9 @@ class YOLOE:
                          that reference image path/array here.
             return_dict: If True, returns a JSON-compatible dictionary summarizing
                          **all** detections. Otherwise returns the raw Results list.
+            include_masks: If False, the summary dict skips mask polygon extraction
+                           (the contour tracing dominates postprocessing with many
+                           detections) and "masks" holds None per detection.
             **kwargs: Other valid arguments for Ultralytics model.predict().
             
         Returns:
@@ -288,13 +646,17 @@ class YOLOE:
             elif mode == "text-prompted":
                 if prompt is None or not isinstance(prompt, list):
                     raise ValueError("For text-prompted mode, prompt must be a list of class strings.")
-                # Set classes for text mode
-                self.class_names = prompt
-                self.embeddings = self.model.get_text_pe(prompt)
-                self.model.set_classes(prompt, self.embeddings)
+                # Set classes for text mode, unless the model already holds them
+                if prompt != self.class_names:
+                    self.class_names = list(prompt)
+                    self.embeddings = self._get_text_pe(prompt)
+                    self.model.set_classes(prompt, self.embeddings)
             elif mode == "image-prompted":
                 if not (isinstance(prompt, dict) and "bboxes" in prompt and "cls" in prompt):
                     raise ValueError("For image-prompted mode, prompt must be a dict with 'bboxes' & 'cls'.")
+                # Visual prompts replace the model's classes; text classes must be set again
+                self.class_names = None
+                self.embeddings = None
                 kwargs["visual_prompts"] = prompt
                 kwargs["predictor"] = YOLOEVPSegPredictor
                 if refer_image is not None:
@@ -308,18 +670,30 @@ class YOLOE:
             kwargs["project"] = os.path.dirname(save_dir)
             kwargs["name"] = os.path.basename(save_dir)
         
+        # FP16 inference for prompt-free / text-prompted modes. The visual-prompt
+        # predictor builds its prompt tensors in FP32, so it keeps full precision.
+        if self.half and "predictor" not in kwargs:
+            kwargs.setdefault("half", True)
+
+        # When summarizing, stream the results so each image is folded into the
+        # summary as soon as it is ready instead of materializing the whole list
+        if return_dict:
+            kwargs.setdefault("stream", True)
+
         # Run inference
         results = self.model.predict(
             source=processed_source,
             conf=conf,
             iou=iou,
+            max_det=max_det,
+            agnostic_nms=agnostic_nms,
             save=save,
             **kwargs
         )
         
         # Return results in desired format
         if return_dict:
-            return self._convert_results_to_summary_dict(results)
+            return self._convert_results_to_summary_dict(results, include_masks)
         else:
             return results
     
@@ -387,12 +761,7 @@ class YOLOE:
         Returns:
             Dict or list of Ultralytics Results objects, depending on `return_dict`.
         """
-        # Switch to text-prompted and set classes
-        self._switch_to_mode("text-prompted")
-        self.class_names = class_names
-        self.embeddings = self.model.get_text_pe(class_names)
-        self.model.set_classes(class_names, self.embeddings)
-
+        # predict() switches to text-prompted mode and sets the classes if they changed
         return self.predict(
             source=source,
             conf=conf,
@@ -466,6 +835,7 @@ class YOLOE:
         save: bool = False,
         save_dir: Optional[str] = None,
         return_dict: bool = True,
+        include_masks: bool = True,
         **kwargs
     ) -> Union[Dict[str, List[Any]], List[Any]]:
         """
@@ -482,37 +852,22 @@ class YOLOE:
             save: Whether to save annotated outputs to disk.
             save_dir: Directory in which to save outputs (if save=True).
             return_dict: If True, returns a JSON-compatible summary dict of results.
+            include_masks: If False, the summary dict skips mask polygons (see predict()).
             **kwargs: Additional predict() arguments.
             
         Returns:
             Dict or list of Ultralytics Results objects, depending on `return_dict`.
         """
         if mode == "prompt-free":
-            return self.prompt_free_predict(
-                sources,
-                conf=conf,
-                iou=iou,
-                save=save,
-                save_dir=save_dir,
-                return_dict=return_dict,
-                **kwargs
-            )
+            predict_chunk = self.prompt_free_predict
         elif mode == "text-prompted":
             if not (isinstance(prompts, list) and all(isinstance(x, str) for x in prompts)):
                 raise ValueError("For text-prompted mode, `prompts` must be a list of strings.")
-            return self.text_predict(
-                sources,
-                class_names=prompts,
-                conf=conf,
-                iou=iou,
-                save=save,
-                save_dir=save_dir,
-                return_dict=return_dict,
-                **kwargs
-            )
+            predict_chunk = functools.partial(self.text_predict, class_names=prompts)
         elif mode == "image-prompted":
             if not (isinstance(prompts, dict) and "bboxes" in prompts and "cls" in prompts):
                 raise ValueError("For image-prompted mode, `prompts` must be a dict with 'bboxes' and 'cls'.")
+            # Visual prompts may be given per image, so the sources are not re-chunked
             return self.image_predict(
                 sources,
                 visual_prompts=prompts,
@@ -522,6 +877,7 @@ class YOLOE:
                 save=save,
                 save_dir=save_dir,
                 return_dict=return_dict,
+                include_masks=include_masks,
                 **kwargs
             )
         else:
@@ -529,6 +885,34 @@ class YOLOE:
                 f"Unknown mode '{mode}'. Must be one of: 'prompt-free', 'text-prompted', 'image-prompted'."
             )
 
+        # Run prompt-free / text-prompted sources in fixed-size chunks, each as one
+        # batched forward pass, then merge the results
+        if not isinstance(sources, list):
+            sources = [sources]
+        results = []
+        for chunk in self._chunks(sources, self.OPTIMAL_BATCH):
+            chunk_kwargs = {"batch": len(chunk), **kwargs}
+            results.extend(predict_chunk(
+                chunk,
+                conf=conf,
+                iou=iou,
+                save=save,
+                save_dir=save_dir,
+                return_dict=False,
+                **chunk_kwargs
+            ))
+        if return_dict:
+            return self._convert_results_to_summary_dict(results, include_masks)
+        return results
+
+    @staticmethod
+    def _chunks(items: List[Any], size: int):
+        """
+        Yields consecutive slices of `items` with at most `size` elements.
+        """
+        for start in range(0, len(items), size):
+            yield items[start:start + size]
+
     def visualize(
         self,
         results: List[Any], 
@@ -542,7 +926,8 @@ class YOLOE:
         Args:
             results (List[Any]): List of Ultralytics Results objects.
             index (int): Which result index to plot (for batch predictions).
-            save (bool): Whether to save the annotated image.
+            save (bool): Whether to save the annotated image. The file is written
+                         in the background; call `wait_for_writes()` before reading it.
             save_path (str): Optional path to save the annotated image.
             
         Returns:
@@ -558,9 +943,31 @@ class YOLOE:
                 os.makedirs("./runs/detect", exist_ok=True)
                 save_path = os.path.join("./runs/detect", f"result_{index}.jpg")
             os.makedirs(os.path.dirname(os.path.abspath(save_path)), exist_ok=True)
-            cv2.imwrite(save_path, plot_image)
+            # Encode now (the caller may modify the returned array) and leave the
+            # disk write to the writer threads; see wait_for_writes()
+            ext = os.path.splitext(save_path)[1].lower() or ".jpg"
+            params = [cv2.IMWRITE_JPEG_QUALITY, self.VISUALIZE_JPEG_QUALITY] if ext in (".jpg", ".jpeg") else []
+            ok, buf = cv2.imencode(ext, plot_image, params)
+            if not ok:
+                raise ValueError(f"Could not encode visualization for {save_path}")
+            self._pending_writes = [f for f in self._pending_writes if not f.done()]
+            self._pending_writes.append(self._writer.submit(self._write_file, save_path, buf))
         
         return plot_image
+
+    @staticmethod
+    def _write_file(path: str, buf: np.ndarray) -> None:
+        with open(path, "wb") as f:
+            f.write(buf.tobytes())
+
+    def wait_for_writes(self) -> None:
+        """
+        Blocks until every image saved by `visualize` has been written to disk,
+        re-raising the first write error, if any.
+        """
+        pending, self._pending_writes = self._pending_writes, []
+        for future in wait(pending).done:
+            future.result()
     
 
 # ---------------------------------------------------------------------------- #
@@ -577,10 +984,11 @@ if __name__ == "__main__":
     os.makedirs("./test_results", exist_ok=True)
     
     print("=== Testing YOLOE Model with Config-Based Model Paths ===")
-    print(f"Using YOLOE-SEG path: {YOLOE_SEG_PATH}")
-    print(f"Using YOLOE-SEG-PF path: {YOLOE_SEG_PF_PATH}")
+    seg_path, seg_pf_path, _ = _resolve_model_paths()
+    print(f"Using YOLOE-SEG path: {seg_path}")
+    print(f"Using YOLOE-SEG-PF path: {seg_pf_path}")
     
-    model = YOLOE()  # Will use YOLOE_SEG_PF_PATH by default for prompt-free
+    model = YOLOE()  # Will use the YOLOE-SEG-PF model by default for prompt-free
 
     # 1) Prompt-free prediction
     print("\n1) Prompt-free prediction with a single image:")
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, computed_field, field_validator, model_validator
 from typing import List, Optional, Dict, Any
 
 class VisualPromptData(BaseModel):
@@ -15,6 +15,21 @@ class VisualPromptData(BaseModel):
         description="List of class IDs, must match length of bboxes."
     )
 
+    @field_validator("bboxes")
+    @classmethod
+    def check_bbox_size(cls_, bboxes: List[List[float]]) -> List[List[float]]:
+        for i, bbox in enumerate(bboxes):
+            if len(bbox) != 4:
+                raise ValueError(f"Each bounding box must contain exactly 4 values [x1,y1,x2,y2]. Error in box {i+1}: {bbox}")
+        return bboxes
+
+    @model_validator(mode="after")
+    def check_lengths_match(self) -> "VisualPromptData":
+        if len(self.bboxes) != len(self.cls):
+            raise ValueError(f"Length of bboxes ({len(self.bboxes)}) must match length of cls ({len(self.cls)}). "
+                             f"Each bounding box must have a corresponding class ID.")
+        return self
+
 class AnnotationData(BaseModel):
     """
     Represents a single annotation object as expected from the frontend.
@@ -30,9 +45,14 @@ class AnnotationData(BaseModel):
     confidence: Optional[float] = None
 
     # Handle potential alias and prioritize user label
-    def get_effective_category_name(self) -> Optional[str]:
+    @computed_field
+    @property
+    def effective_category_name(self) -> Optional[str]:
         return self.userLabel or self.category_name or self.originalClass
 
+    def get_effective_category_name(self) -> Optional[str]:
+        return self.effective_category_name
+
     # Convert to dict suitable for conversion function
     def to_conversion_dict(self) -> dict:
         return {
@@ -40,7 +60,7 @@ class AnnotationData(BaseModel):
             "y": self.y,
             "width": self.width,
             "height": self.height,
-            "category_name": self.get_effective_category_name()
+            "category_name": self.effective_category_name
         }
 
 class ExportYoloRequest(BaseModel):
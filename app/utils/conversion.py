@@ -1,11 +1,159 @@
 # Utility functions for annotation format conversion
 
 import logging
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import numpy as np
+
+# One YOLO label line: class id, then normalized x_center, y_center, width, height
+YOLO_LINE_FORMAT = "%d %.6f %.6f %.6f %.6f"
+# Fallback for annotations that carry neither explicit coordinates nor a bbox
+_NO_BBOX = (0, 0, 0, 0)
+
+@dataclass
+class AnnotationBatch:
+    """
+    Column-wise (structure-of-arrays) view of one image's annotations.
+
+    Built once at the API boundary so the conversion works on contiguous
+    float64 columns instead of looking up keys row by row.
+
+    Attributes:
+        x, y, w, h: Pixel [x_min, y_min, width, height] columns, shape (N,).
+        category_name: Category name per row.
+        index: Position of each row in the source list, shape (N,).
+        skipped: (index, reason, detail) for source rows dropped while building.
+    """
+    x: np.ndarray
+    y: np.ndarray
+    w: np.ndarray
+    h: np.ndarray
+    category_name: List[Optional[str]]
+    index: np.ndarray
+    skipped: list = field(default_factory=list)
+
+    def __len__(self) -> int:
+        return len(self.category_name)
+
+    @classmethod
+    def from_boxes(cls, boxes: np.ndarray, category_name: list, index=None, skipped=None) -> "AnnotationBatch":
+        """
+        Builds a batch from an (N, 4) [x_min, y_min, width, height] array.
+        """
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        if index is None:
+            index = np.arange(len(boxes))
+        # Column views of one Fortran-ordered copy keep each column contiguous
+        columns = np.asfortranarray(boxes)
+        return cls(columns[:, 0], columns[:, 1], columns[:, 2], columns[:, 3],
+                   list(category_name), np.asarray(index), skipped or [])
+
+    @classmethod
+    def from_dicts(cls, annotations: list) -> "AnnotationBatch":
+        """
+        Builds a batch from annotation dictionaries.
+
+        Each dict should have 'category_name' (str) and either 'x', 'y',
+        'width', 'height' or 'bbox' ([x_min, y_min, width, height]); explicit
+        fields take precedence over the bbox. Rows whose coordinates cannot be
+        read are recorded in `skipped` instead of raising.
+        """
+        names = []
+        boxes = []
+        index = []
+        skipped = []
+        for position, ann in enumerate(annotations):
+            try:
+                # Frontend sends x, y, width, height directly
+                if 'x' in ann and 'y' in ann and 'width' in ann and 'height' in ann:
+                    box = (float(ann['x']), float(ann['y']), float(ann['width']), float(ann['height']))
+                else:
+                    # Fill missing fields from bbox, assumed [x_min, y_min, width, height]
+                    bbox = ann.get('bbox', _NO_BBOX)
+                    box = (
+                        float(ann.get('x', bbox[0])),
+                        float(ann.get('y', bbox[1])),
+                        float(ann.get('width', bbox[2])),
+                        float(ann.get('height', bbox[3])),
+                    )
+                # Use category_name, which reflects user edits if any
+                name = ann.get('category_name')
+            except (KeyError, TypeError, ValueError, IndexError) as e:
+                skipped.append((position, "invalid coordinates", e))
+                continue
+            names.append(name)
+            boxes.append(box)
+            index.append(position)
+        return cls.from_boxes(boxes, names, index, skipped)
+
+    @classmethod
+    def from_models(cls, annotations: list) -> "AnnotationBatch":
+        """
+        Builds a batch from validated AnnotationData models (x, y, width,
+        height and effective_category_name attributes).
+        """
+        boxes = np.fromiter(
+            (v for ann in annotations for v in (ann.x, ann.y, ann.width, ann.height)),
+            dtype=np.float64,
+            count=4 * len(annotations)
+        )
+        return cls.from_boxes(boxes, [ann.effective_category_name for ann in annotations])
+
+def convert_batch_to_yolo_format(batch: AnnotationBatch, image_width: int, image_height: int, class_name_to_id: dict) -> str:
+    """
+    Converts an AnnotationBatch to a YOLO format string.
+
+    Args:
+        batch: The image's annotations as an AnnotationBatch.
+        image_width: The width of the image.
+        image_height: The height of the image.
+        class_name_to_id: A dictionary mapping category names (str) to YOLO class IDs (int, 0-based).
+
+    Returns:
+        A string containing annotations in YOLO format, one line per annotation.
+        Returns an empty string if the batch is empty or image dimensions are invalid.
+    """
+    if (not len(batch) and not batch.skipped) or image_width <= 0 or image_height <= 0:
+        return ""
+
+    # Only the class lookup is per row; the coordinates stay columnar
+    class_ids = []
+    keep = []
+    skipped = list(batch.skipped)
+    for row, class_name in enumerate(batch.category_name):
+        # Single dict probe; None covers both a missing name and an unknown class
+        try:
+            class_id = class_name_to_id.get(class_name) if class_name is not None else None
+        except TypeError:
+            # Unhashable name (e.g. a list in a dict input); skipped like the baseline did
+            skipped.append((int(batch.index[row]), "invalid category_name", class_name))
+            continue
+        if class_id is None:
+            skipped.append((int(batch.index[row]), "unknown category_name", class_name))
+            continue
+        class_ids.append(class_id)
+        keep.append(row)
+
+    if batch.skipped:
+        skipped.sort(key=lambda item: item[0])
+    _log_skipped(skipped)
+
+    if not class_ids:
+        return ""
+
+    boxes = np.column_stack((batch.x, batch.y, batch.w, batch.h))
+    if len(keep) != len(batch):
+        boxes = boxes[keep]
+    return _format_yolo_lines(class_ids, boxes, image_width, image_height)
 
 def convert_to_yolo_format(annotations: list, image_width: int, image_height: int, class_name_to_id: dict) -> str:
     """
     Converts a list of annotations to YOLO format string.
 
+    Kept for dict-based call sites; builds an AnnotationBatch and delegates to
+    convert_batch_to_yolo_format().
+
     Args:
         annotations: A list of annotation dictionaries. Each dict should have
                      'bbox' (list/tuple: [x_min, y_min, width, height]) and
@@ -20,50 +168,81 @@ def convert_to_yolo_format(annotations: list, image_width: int, image_height: in
     """
     if not annotations or image_width <= 0 or image_height <= 0:
         return ""
+    return convert_batch_to_yolo_format(AnnotationBatch.from_dicts(annotations), image_width, image_height, class_name_to_id)
 
-    yolo_lines = []
-    for ann in annotations:
-        try:
-            # Use category_name, which reflects user edits if any
-            class_name = ann.get('category_name')
-            if class_name is None or class_name not in class_name_to_id:
-                logging.warning(f"Skipping annotation due to missing or unknown category_name: {ann}")
-                continue
+def convert_annotation_models_to_yolo(annotations: list, image_width: int, image_height: int, class_name_to_id: dict) -> str:
+    """
+    Converts validated AnnotationData models to a YOLO format string.
 
-            class_id = class_name_to_id[class_name]
-
-            # Assuming bbox is [x_min, y_min, width, height]
-            # Frontend sends x, y, width, height directly
-            x_min = float(ann.get('x', ann.get('bbox', [0,0,0,0])[0]))
-            y_min = float(ann.get('y', ann.get('bbox', [0,0,0,0])[1]))
-            width = float(ann.get('width', ann.get('bbox', [0,0,0,0])[2]))
-            height = float(ann.get('height', ann.get('bbox', [0,0,0,0])[3]))
-
-            # Calculate center coordinates and dimensions
-            x_center = x_min + width / 2
-            y_center = y_min + height / 2
-
-            # Normalize coordinates and dimensions
-            x_center_norm = x_center / image_width
-            y_center_norm = y_center / image_height
-            width_norm = width / image_width
-            height_norm = height / image_height
-
-            # Clamp values to be within [0.0, 1.0] to avoid issues with minor rounding errors
-            x_center_norm = max(0.0, min(1.0, x_center_norm))
-            y_center_norm = max(0.0, min(1.0, y_center_norm))
-            width_norm = max(0.0, min(1.0, width_norm))
-            height_norm = max(0.0, min(1.0, height_norm))
-
-            # Format the YOLO line
-            yolo_line = f"{class_id} {x_center_norm:.6f} {y_center_norm:.6f} {width_norm:.6f} {height_norm:.6f}"
-            yolo_lines.append(yolo_line)
-
-        except (KeyError, TypeError, ValueError, IndexError) as e:
-            logging.warning(f"Skipping annotation due to error: {e}. Annotation data: {ann}")
-            continue
+    Same output as convert_to_yolo_format(), but reads the coordinates straight
+    from the models into an AnnotationBatch instead of going through a dict per
+    annotation.
+
+    Args:
+        annotations: A list of AnnotationData models (x, y, width, height and
+                     effective_category_name attributes).
+        image_width: The width of the image.
+        image_height: The height of the image.
+        class_name_to_id: A dictionary mapping category names (str) to YOLO class IDs (int, 0-based).
 
-    return "\n".join(yolo_lines)
+    Returns:
+        A string containing annotations in YOLO format, one line per annotation.
+    """
+    if not annotations or image_width <= 0 or image_height <= 0:
+        return ""
+    return convert_batch_to_yolo_format(AnnotationBatch.from_models(annotations), image_width, image_height, class_name_to_id)
+
+def _log_skipped(skipped: list) -> None:
+    """
+    Emits one warning for all annotations skipped in a conversion, listing
+    the first few as (index, reason, detail).
+    """
+    if skipped and logging.getLogger().isEnabledFor(logging.WARNING):
+        logging.warning("Skipped %d annotation(s) during YOLO conversion: %s%s",
+                        len(skipped), skipped[:10], " ..." if len(skipped) > 10 else "")
+
+def _format_yolo_lines(class_ids: list, boxes: np.ndarray, image_width: int, image_height: int) -> str:
+    """
+    Normalizes (N, 4) [x_min, y_min, width, height] pixel boxes and formats one
+    YOLO line per box.
+    """
+    # Calculate center coordinates and normalize all boxes in place in a single
+    # output buffer (float64, same operation order as the scalar formula so the
+    # output is unchanged)
+    normalized = np.empty_like(boxes, dtype=np.float64)
+    np.divide(boxes[:, 2:], 2, out=normalized[:, :2])
+    np.add(boxes[:, :2], normalized[:, :2], out=normalized[:, :2])
+    normalized[:, 2:] = boxes[:, 2:]
+    normalized /= np.array([image_width, image_height, image_width, image_height], dtype=np.float64)
+
+    # Clamp values to be within [0.0, 1.0] to avoid issues with minor rounding errors.
+    # fmin/fmax treat NaN like the scalar min/max did; + 0.0 turns -0.0 into 0.0.
+    np.fmin(normalized, 1.0, out=normalized)
+    np.fmax(normalized, 0.0, out=normalized)
+    normalized += 0.0
+
+    # Format all YOLO lines with a single %-format call over one flat tuple of
+    # values instead of one f-string per line (class ids are exact in float64)
+    rows = np.empty((len(class_ids), 5), dtype=np.float64)
+    rows[:, 0] = class_ids
+    rows[:, 1:] = normalized
+    return "\n".join([YOLO_LINE_FORMAT] * len(class_ids)) % tuple(rows.ravel().tolist())
+
+def convert_batch_item_to_yolo(item: tuple) -> str:
+    """
+    Single-argument wrapper for Executor.map.
+
+    Args:
+        item: (annotations, image_width, image_height, class_name_to_id) tuple,
+              where annotations is an AnnotationBatch or a list of dicts.
+
+    Returns:
+        The YOLO format string for that image.
+    """
+    annotations, image_width, image_height, class_name_to_id = item
+    if isinstance(annotations, AnnotationBatch):
+        return convert_batch_to_yolo_format(annotations, image_width, image_height, class_name_to_id)
+    return convert_to_yolo_format(annotations, image_width, image_height, class_name_to_id)
 
 # Example Usage (for testing):
 if __name__ == '__main__':
@@ -1,12 +1,91 @@
-import base64
+import asyncio
 import io
 import logging
+from typing import List
+
+try:
+    # SIMD-accelerated drop-in replacement for the stdlib module
+    import pybase64 as base64
+    # Encodes straight to str, skipping the intermediate bytes object and .decode()
+    _b64encode_str = base64.b64encode_as_string
+except ImportError:
+    import base64
+
+    def _b64encode_str(data) -> str:
+        return base64.b64encode(data).decode("ascii")
 
 import cv2
 import numpy as np
 from PIL import Image
 from fastapi import UploadFile
 
+# JPEG files start with an SOI marker followed by another marker
+_JPEG_MAGIC = b"\xff\xd8\xff"
+# Lazily created PyTurboJPEG handle; False once it is known to be unavailable
+_turbojpeg = None
+_TJPF_BGR = None
+_TJSAMP_420 = None
+
+
+def _get_turbojpeg():
+    """
+    Returns a shared TurboJPEG instance, or None if PyTurboJPEG/libturbojpeg is not installed.
+    """
+    global _turbojpeg, _TJPF_BGR, _TJSAMP_420
+    if _turbojpeg is None:
+        try:
+            from turbojpeg import TurboJPEG, TJPF_BGR, TJSAMP_420
+            _turbojpeg = TurboJPEG()
+            _TJPF_BGR = TJPF_BGR
+            _TJSAMP_420 = TJSAMP_420
+        except (ImportError, OSError, RuntimeError) as e:
+            logging.info(f"TurboJPEG unavailable, using OpenCV for JPEG decoding/encoding: {e}")
+            _turbojpeg = False
+    return _turbojpeg or None
+
+
+def _ensure_rgb(image: Image.Image) -> Image.Image:
+    """
+    Returns the image in RGB mode; convert() always copies, so it is skipped for RGB sources.
+    """
+    return image if image.mode == "RGB" else image.convert("RGB")
+
+
+def _decode_image_bytes(image_bytes: bytes) -> np.ndarray:
+    """
+    Decodes raw image bytes into a NumPy BGR image array.
+    """
+    if not image_bytes:
+        raise ValueError("Uploaded file is empty or invalid.")
+    # JPEG is by far the most common upload; libturbojpeg decodes it to BGR directly
+    if image_bytes[:3] == _JPEG_MAGIC:
+        tj = _get_turbojpeg()
+        if tj is not None:
+            try:
+                return tj.decode(image_bytes, pixel_format=_TJPF_BGR)
+            except Exception as e:
+                logging.debug(f"TurboJPEG failed to decode image, falling back to OpenCV: {e}")
+    # Decode straight to BGR with OpenCV (libjpeg-turbo/libpng, releases the GIL).
+    # EXIF orientation is ignored to match the PIL path below.
+    image_bgr = cv2.imdecode(
+        np.frombuffer(image_bytes, dtype=np.uint8),
+        cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION
+    )
+    if image_bgr is not None:
+        return image_bgr
+    # Fall back to PIL for formats OpenCV cannot decode (e.g. GIF)
+    image_stream = io.BytesIO(image_bytes)
+    pil_image = _ensure_rgb(Image.open(image_stream))
+    # Convert PIL -> OpenCV (BGR); cvtColor writes the BGR copy, so asarray's view is enough
+    return cv2.cvtColor(np.asarray(pil_image), cv2.COLOR_RGB2BGR)
+
+
+def _decode_image_file(fp) -> np.ndarray:
+    """
+    Reads an open binary file object and decodes it into a NumPy BGR image array.
+    """
+    return _decode_image_bytes(fp.read())
+
 
 def read_imagefile(file: UploadFile) -> np.ndarray:
     """
@@ -15,14 +94,7 @@ def read_imagefile(file: UploadFile) -> np.ndarray:
     Note: This is the synchronous version. For async endpoints, use read_imagefile_async.
     """
     try:
-        image_bytes = file.file.read()
-        if not image_bytes:
-            raise ValueError("Uploaded file is empty or invalid.")
-        image_stream = io.BytesIO(image_bytes)
-        pil_image = Image.open(image_stream).convert("RGB")
-        # Convert PIL -> OpenCV (BGR)
-        cv2_image = cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
-        return cv2_image
+        return _decode_image_bytes(file.file.read())
     except Exception as e:
         logging.error(f"Error reading image file {file.filename}: {e}")
         raise ValueError(f"Failed to read image file: {e}")
@@ -35,16 +107,13 @@ def read_imagefile(file: UploadFile) -> np.ndarray:
 async def read_imagefile_async(file: UploadFile) -> np.ndarray:
     """
     Asynchronously converts an uploaded file into a NumPy BGR image array.
+
+    Decoding runs in a worker thread so it does not block the event loop.
     """
     try:
-        image_bytes = await file.read()
-        if not image_bytes:
-            raise ValueError("Uploaded file is empty or invalid.")
-        image_stream = io.BytesIO(image_bytes)
-        pil_image = Image.open(image_stream).convert("RGB")
-        # Convert PIL -> OpenCV (BGR)
-        cv2_image = cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
-        return cv2_image
+        # Read the spooled upload and decode it in one worker-thread hop
+        await file.seek(0)
+        return await asyncio.to_thread(_decode_image_file, file.file)
     except Exception as e:
         logging.error(f"Error reading image file {file.filename}: {e}")
         raise ValueError(f"Failed to read image file: {e}")
@@ -52,22 +121,144 @@ async def read_imagefile_async(file: UploadFile) -> np.ndarray:
         # Reset file pointer
         await file.seek(0)
 
-def encode_bgr_image_to_base64(image_bgr: np.ndarray) -> str:
+
+def _open_pil_image(fp) -> Image.Image:
+    """
+    Decodes an open binary file object into an RGB PIL image.
+    """
+    image = _ensure_rgb(Image.open(fp))
+    # Decode now, while still in the worker thread and before the file is rewound
+    image.load()
+    return image
+
+
+async def read_pil_imagefile_async(file: UploadFile) -> Image.Image:
+    """
+    Asynchronously converts an uploaded file into an RGB PIL image.
+
+    PIL reads straight from the spooled upload file (no intermediate bytes
+    copy), and decoding runs in a worker thread so it does not block the event loop.
+    """
+    await file.seek(0)
+    return await asyncio.to_thread(_open_pil_image, file.file)
+
+
+# Supported output formats for annotated preview images: name -> (OpenCV extension, PIL format)
+IMAGE_FORMATS = {
+    "jpeg": (".jpg", "JPEG"),
+    "jpg": (".jpg", "JPEG"),
+    "png": (".png", "PNG"),
+    "webp": (".webp", "WEBP"),
+}
+DEFAULT_IMAGE_QUALITY = 85
+# Content-Type for each canonical output format, for endpoints that return raw image bytes
+IMAGE_MEDIA_TYPES = {
+    "jpeg": "image/jpeg",
+    "png": "image/png",
+    "webp": "image/webp",
+}
+
+
+def normalize_image_format(image_format: str) -> str:
     """
-    Encodes an OpenCV BGR image as base64 JPEG string.
+    Validates an output image format name and returns its canonical lowercase form.
     """
-    success, encoded_image = cv2.imencode(".jpg", image_bgr)
+    fmt = (image_format or "").strip().lower()
+    if fmt not in IMAGE_FORMATS:
+        raise ValueError(
+            f"Unsupported image format '{image_format}'. Expected one of: jpeg, png, webp."
+        )
+    return "jpeg" if fmt == "jpg" else fmt
+
+
+def _encode_params(image_format: str, quality: int) -> list:
+    if image_format == "jpeg":
+        return [cv2.IMWRITE_JPEG_QUALITY, quality]
+    if image_format == "webp":
+        return [cv2.IMWRITE_WEBP_QUALITY, quality]
+    return []
+
+
+def _encode_bgr_image(image_bgr: np.ndarray, image_format: str, quality: int):
+    """
+    Encodes an OpenCV BGR image, returning a bytes-like object (bytes or a uint8 ndarray).
+    """
+    if image_format == "jpeg":
+        # libturbojpeg encodes BGR directly with SIMD DCT/Huffman (4:2:0, no
+        # Huffman optimization pass - the same output settings as OpenCV)
+        tj = _get_turbojpeg()
+        if tj is not None:
+            try:
+                return tj.encode(image_bgr, quality=quality, pixel_format=_TJPF_BGR,
+                                 jpeg_subsample=_TJSAMP_420)
+            except Exception as e:
+                logging.debug(f"TurboJPEG failed to encode image, falling back to OpenCV: {e}")
+    ext = IMAGE_FORMATS[image_format][0]
+    success, encoded_image = cv2.imencode(ext, image_bgr, _encode_params(image_format, quality))
     if not success:
-        raise ValueError("Failed to encode image to JPEG.")
-    base64_str = base64.b64encode(encoded_image.tobytes()).decode("utf-8")
-    return base64_str
+        raise ValueError(f"Failed to encode image to {image_format.upper()}.")
+    return encoded_image
 
-def encode_mask_to_base64(mask: np.ndarray) -> str:
+
+def encode_bgr_image_raw(image_bgr: np.ndarray, image_format: str = "jpeg",
+                         quality: int = DEFAULT_IMAGE_QUALITY) -> bytes:
     """
-    Encodes a segmentation mask as base64 PNG string.
+    Encodes an OpenCV BGR image as raw image file bytes (JPEG by default).
+    """
+    encoded = _encode_bgr_image(image_bgr, normalize_image_format(image_format), quality)
+    return encoded if isinstance(encoded, bytes) else encoded.tobytes()
+
+
+def encode_bgr_image_to_base64(image_bgr: np.ndarray, image_format: str = "jpeg",
+                               quality: int = DEFAULT_IMAGE_QUALITY) -> str:
     """
+    Encodes an OpenCV BGR image as base64 string (JPEG by default).
+    """
+    encoded = _encode_bgr_image(image_bgr, normalize_image_format(image_format), quality)
+    # b64encode reads the ndarray's buffer directly; tobytes() would copy it first
+    return _b64encode_str(memoryview(encoded))
+
+def _encode_mask_png(mask: np.ndarray) -> np.ndarray:
     success, encoded_mask = cv2.imencode(".png", mask)
     if not success:
         raise ValueError("Failed to encode mask to PNG.")
-    base64_str = base64.b64encode(encoded_mask.tobytes()).decode("utf-8")
-    return base64_str
\ No newline at end of file
+    return encoded_mask
+
+def encode_mask_to_png(mask: np.ndarray) -> bytes:
+    """
+    Encodes a segmentation mask as raw PNG bytes.
+    """
+    return _encode_mask_png(mask).tobytes()
+
+def encode_mask_to_base64(mask: np.ndarray) -> str:
+    """
+    Encodes a segmentation mask as base64 PNG string.
+    """
+    return _b64encode_str(memoryview(_encode_mask_png(mask)))
+
+def pack_masks(masks: np.ndarray) -> np.ndarray:
+    """
+    Packs binary masks of shape (N, H, W) into one bitmap row per mask, 1 bit per pixel.
+
+    Each mask is flattened row-major and packed MSB-first with np.packbits;
+    decode with np.unpackbits(buf)[:H * W].reshape(H, W).
+    """
+    return np.packbits(masks.reshape(len(masks), -1), axis=1)
+
+def encode_packed_masks_to_base64(masks: np.ndarray) -> List[str]:
+    """
+    Encodes binary masks of shape (N, H, W) as base64 bitmaps, 1 bit per pixel
+    (see pack_masks for the layout).
+    """
+    return [_b64encode_str(memoryview(row)) for row in pack_masks(masks)]
+
+def encode_pil_image_to_base64(image: Image.Image, image_format: str = "jpeg",
+                               quality: int = DEFAULT_IMAGE_QUALITY) -> str:
+    """
+    Encodes a PIL image as base64 string (JPEG by default).
+    """
+    image_format = normalize_image_format(image_format)
+    save_kwargs = {} if image_format == "png" else {"quality": quality}
+    buffered = io.BytesIO()
+    image.save(buffered, format=IMAGE_FORMATS[image_format][1], **save_kwargs)
+    return _b64encode_str(buffered.getbuffer())
@@ -1,42 +1,145 @@
 # main.py
 
+import asyncio
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
 import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
+from starlette.datastructures import MutableHeaders
 
-# Import the master router from router.py
-from router.router import api_router
+# Only lightweight imports at module level: the export pool's spawn workers re-run this
+# file as __mp_main__, so the routers (and torch, ultralytics, transformers) are imported
+# inside create_app() instead
+from app.config import config
 
 logging.basicConfig(level=logging.DEBUG, format="%(asctime)s - %(levelname)s - %(message)s")
 
-app = FastAPI(
-    title='EurekAnno',
-    description="API for EurekAnno",
-    version='1.0.0',
-    docs_url='/docs',
-    redoc_url='/redoc'
-)
-app.include_router(api_router, prefix='/api/v1')
-
-origins = [
-    "http://localhost",
-    "http://localhost:8000",
-    "http://localhost:3000",
-    "http://127.0.0.1:8080",
-]
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-@app.get("/")
-async def root():
-    return "FASTAPI TEMPLATE FOR EUREKAI LAB"
+# Already-compressed payloads (JPEG/PNG images, zip exports, multipart image/mask parts)
+GZIP_EXCLUDED_MEDIA_TYPES = ("image/", "application/zip", "multipart/")
+
+class SelectiveGZipMiddleware:
+    """
+    GZipMiddleware that skips media types which are already compressed.
+
+    Gzipping JPEG/PNG or zip bodies costs CPU and saves nothing. Responses matching
+    excluded_media_types are tagged with "Content-Encoding: identity" before they reach
+    GZipMiddleware, which passes encoded responses through untouched; the tag is
+    removed again before the response leaves the app.
+    """
+
+    def __init__(self, app, minimum_size=500, compresslevel=9, excluded_media_types=GZIP_EXCLUDED_MEDIA_TYPES):
+        self.app = app
+        self.excluded_media_types = tuple(excluded_media_types)
+        self.gzip = GZipMiddleware(self._tag_excluded, minimum_size=minimum_size, compresslevel=compresslevel)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_untagged(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [
+                    (name, value) for name, value in message["headers"]
+                    if (name.lower(), value.lower()) != (b"content-encoding", b"identity")
+                ]
+            await send(message)
+
+        await self.gzip(scope, receive, send_untagged)
+
+    async def _tag_excluded(self, scope, receive, send):
+        async def send_tagged(message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                media_type = headers.get("content-type", "").lower()
+                if "content-encoding" not in headers and media_type.startswith(self.excluded_media_types):
+                    headers["Content-Encoding"] = "identity"
+            await send(message)
+
+        await self.app(scope, receive, send_tagged)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    from app.api.yoloe import get_yoloe, shutdown_export_pool, yoloe_batcher
+
+    # Bounded pool for the image decode/encode work handlers offload via asyncio.to_thread
+    executor = ThreadPoolExecutor(
+        max_workers=config.get_thread_pool_workers(),
+        thread_name_prefix="eurekanno-worker"
+    )
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(executor)
+    # uvicorn[standard] runs on uvloop when it is installed; plain asyncio otherwise
+    logging.info(f"Event loop: {type(loop).__module__}.{type(loop).__name__}")
+    # Load the default YOLOE weights before serving so the first request doesn't pay for it
+    if config.get_preload_models():
+        try:
+            await get_yoloe("default")
+        except Exception as e:
+            logging.warning(f"Failed to preload default YOLOE model: {e}")
+    yield
+    await yoloe_batcher.close()
+    shutdown_export_pool()
+    executor.shutdown(wait=False)
+
+def create_app() -> FastAPI:
+    """
+    Build the FastAPI application.
+
+    The routers are imported here rather than at module level, so processes that
+    only import main.py (spawned export pool workers) never load the models' libraries.
+    """
+    # Import the master router from router.py
+    from router.router import api_router
+
+    app = FastAPI(
+        title='EurekAnno',
+        description="API for EurekAnno",
+        version='1.0.0',
+        docs_url='/docs',
+        redoc_url='/redoc',
+        # Serialize JSON bodies with orjson (much faster on the float-heavy detection payloads)
+        default_response_class=ORJSONResponse,
+        lifespan=lifespan
+    )
+    app.include_router(api_router, prefix='/api/v1')
+
+    origins = [
+        "http://localhost",
+        "http://localhost:8000",
+        "http://localhost:3000",
+        "http://127.0.0.1:8080",
+    ]
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=origins,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    # Compress JSON / base64 image payloads for clients that accept gzip
+    app.add_middleware(SelectiveGZipMiddleware, minimum_size=1024)
+
+    @app.get("/")
+    async def root():
+        return "FASTAPI TEMPLATE FOR EUREKAI LAB"
+
+    return app
+
+def __getattr__(name):
+    # `uvicorn main:app` still works: the app is built on first access
+    if name == "app":
+        globals()["app"] = create_app()
+        return globals()["app"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # loop/http "auto" pick uvloop and httptools when installed (uvicorn[standard]).
+    # A single worker process: each worker would load its own copy of the GPU models.
+    uvicorn.run("main:create_app", factory=True, host="0.0.0.0", port=8000, loop="auto", http="auto")
@@ -0,0 +1,28 @@
+"""
+pytest configuration for the API tests.
+
+Tests marked ``integration`` talk to a running server and are skipped
+unless pytest is invoked with ``--run-integration``.
+"""
+
+import pytest
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--run-integration", action="store_true", default=False,
+        help="Run tests that need a running API server"
+    )
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "integration: needs a running API server (enable with --run-integration)")
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--run-integration"):
+        return
+    skip = pytest.mark.skip(reason="needs --run-integration")
+    for item in items:
+        if "integration" in item.keywords:
+            item.add_marker(skip)
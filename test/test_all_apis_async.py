@@ -9,6 +9,7 @@ Date: 2025-05-25
 """
 
 import asyncio
+import functools
 import aiohttp
 import json
 import time
@@ -17,6 +18,55 @@ import io
 import os
 
 
+# 并发请求上限：超过后服务端排队只会拉长尾延迟，吞吐不再提升
+MAX_CONCURRENCY = 8
+
+
+def create_connector():
+    """创建与并发上限一致的连接池（复用 keep-alive 连接，缓存 DNS 解析）"""
+    return aiohttp.TCPConnector(limit=MAX_CONCURRENCY, ttl_dns_cache=300)
+
+
+# 固定的 multipart 分隔符：相同请求体只需构建一次
+MULTIPART_BOUNDARY = "----EurekAnnoTestBoundary7MA4YWxkTrZu0gW"
+
+
+@functools.lru_cache(maxsize=32)
+def build_multipart(image_data, fields, filename='test.jpg', content_type='image/jpeg'):
+    """
+    构建 multipart/form-data 请求体，返回 (body, Content-Type)
+
+    fields 为 ((名称, 值), ...) 元组。结果会被缓存，重复请求直接复用同一份字节，
+    避免每次请求都重新序列化 FormData。
+    """
+    parts = [
+        f'--{MULTIPART_BOUNDARY}\r\n'
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f'Content-Type: {content_type}\r\n\r\n'.encode() + image_data + b'\r\n'
+    ]
+    for name, value in fields:
+        parts.append(
+            f'--{MULTIPART_BOUNDARY}\r\n'
+            f'Content-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        )
+    parts.append(f'--{MULTIPART_BOUNDARY}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={MULTIPART_BOUNDARY}'
+
+
+async def post_multipart(session, url, image_data, fields):
+    """用预构建的 multipart 请求体发送 POST，返回 (状态码, JSON)"""
+    body, content_type = build_multipart(image_data, tuple(fields.items()))
+    async with session.post(url, data=body, headers={'Content-Type': content_type}) as response:
+        result = await response.json()
+        return response.status, result
+
+
+async def _bounded(sem, coro):
+    """在信号量限制下执行请求协程"""
+    async with sem:
+        return await coro
+
+
 def create_test_image():
     """创建测试图像"""
     # 创建一个带有简单图形的测试图像
@@ -31,7 +81,9 @@ def create_test_image():
     
     # 保存到内存
     img_bytes = io.BytesIO()
-    image.save(img_bytes, format='PNG')
+    # 基准测试衡量的是服务端处理耗时：限制最长边并用 JPEG 编码，减少编解码与传输开销
+    image.thumbnail((1024, 1024), Image.LANCZOS)
+    image.save(img_bytes, format='JPEG', quality=85, subsampling=2)
     img_bytes.seek(0)
     return img_bytes.getvalue(), image
 
@@ -40,74 +92,59 @@ async def test_yoloe_prompt_free(session, url_base, image_data):
     """测试 YOLOe 无提示检测"""
     url = f"{url_base}/api/v1/yoloe/prompt-free"
     
-    data = aiohttp.FormData()
-    data.add_field('file', image_data, filename='test.png', content_type='image/png')
-    data.add_field('conf', '0.25')
-    data.add_field('return_image', 'false')
-    
-    async with session.post(url, data=data) as response:
-        result = await response.json()
-        return response.status, result
+    fields = {
+        'conf': '0.25',
+        'return_image': 'false',
+    }
+    return await post_multipart(session, url, image_data, fields)
 
 
 async def test_yoloe_text_prompt(session, url_base, image_data):
     """测试 YOLOe 文本提示检测"""
     url = f"{url_base}/api/v1/yoloe/text-prompt"
     
-    data = aiohttp.FormData()
-    data.add_field('file', image_data, filename='test.png', content_type='image/png')
-    data.add_field('class_names', '["person", "car"]')
-    data.add_field('conf', '0.25')
-    data.add_field('return_image', 'false')
-    
-    async with session.post(url, data=data) as response:
-        result = await response.json()
-        return response.status, result
+    fields = {
+        'class_names': '["person", "car"]',
+        'conf': '0.25',
+        'return_image': 'false',
+    }
+    return await post_multipart(session, url, image_data, fields)
 
 
 async def test_yoloe_image_prompt(session, url_base, image_data):
     """测试 YOLOe 图像提示检测"""
     url = f"{url_base}/api/v1/yoloe/image-prompt"
     
-    data = aiohttp.FormData()
-    data.add_field('file', image_data, filename='test.png', content_type='image/png')
-    data.add_field('bboxes', '[[100, 100, 200, 300]]')
-    data.add_field('cls', '[0]')
-    data.add_field('conf', '0.25')
-    data.add_field('return_image', 'false')
-    
-    async with session.post(url, data=data) as response:
-        result = await response.json()
-        return response.status, result
+    fields = {
+        'bboxes': '[[100, 100, 200, 300]]',
+        'cls': '[0]',
+        'conf': '0.25',
+        'return_image': 'false',
+    }
+    return await post_multipart(session, url, image_data, fields)
 
 
 async def test_moondream_describe(session, url_base, image_data):
     """测试 Moondream 描述"""
     url = f"{url_base}/api/v1/moondream/describe"
     
-    data = aiohttp.FormData()
-    data.add_field('file', image_data, filename='test.png', content_type='image/png')
-    data.add_field('compile', 'false')
-    data.add_field('return_image', 'false')
-    
-    async with session.post(url, data=data) as response:
-        result = await response.json()
-        return response.status, result
+    fields = {
+        'compile': 'false',
+        'return_image': 'false',
+    }
+    return await post_multipart(session, url, image_data, fields)
 
 
 async def test_moondream_ground(session, url_base, image_data):
     """测试 Moondream 定位"""
     url = f"{url_base}/api/v1/moondream/ground"
     
-    data = aiohttp.FormData()
-    data.add_field('file', image_data, filename='test.png', content_type='image/png')
-    data.add_field('object_name', 'rectangle')
-    data.add_field('compile', 'false')
-    data.add_field('return_image', 'false')
-    
-    async with session.post(url, data=data) as response:
-        result = await response.json()
-        return response.status, result
+    fields = {
+        'object_name': 'rectangle',
+        'compile': 'false',
+        'return_image': 'false',
+    }
+    return await post_multipart(session, url, image_data, fields)
 
 
 async def test_moondream_point(session, url_base, image_data):
@@ -116,65 +153,63 @@ async def test_moondream_point(session, url_base, image_data):
     
     point_data = {"x": 150, "y": 200, "question": "What color is this?"}
     
-    data = aiohttp.FormData()
-    data.add_field('file', image_data, filename='test.png', content_type='image/png')
-    data.add_field('point_data', json.dumps(point_data))
-    data.add_field('compile', 'false')
-    data.add_field('return_image', 'false')
-    
-    async with session.post(url, data=data) as response:
-        result = await response.json()
-        return response.status, result
+    fields = {
+        'point_data': json.dumps(point_data),
+        'compile': 'false',
+        'return_image': 'false',
+    }
+    return await post_multipart(session, url, image_data, fields)
 
 
 async def test_moondream_answer(session, url_base, image_data):
     """测试 Moondream 问答"""
     url = f"{url_base}/api/v1/moondream/answer"
     
-    data = aiohttp.FormData()
-    data.add_field('file', image_data, filename='test.png', content_type='image/png')
-    data.add_field('question', 'How many rectangles are in this image?')
-    data.add_field('compile', 'false')
-    data.add_field('return_image', 'false')
-    
-    async with session.post(url, data=data) as response:
-        result = await response.json()
-        return response.status, result
+    fields = {
+        'question': 'How many rectangles are in this image?',
+        'compile': 'false',
+        'return_image': 'false',
+    }
+    return await post_multipart(session, url, image_data, fields)
 
 
-async def test_concurrent_requests(url_base, image_data, num_concurrent=5):
-    """测试并发请求"""
-    print(f"\n测试 {num_concurrent} 个并发请求...")
+async def test_concurrent_requests(url_base, image_data, num_concurrent=5, session=None):
+    """测试并发请求（传入 session 时复用其连接池）"""
+    if session is None:
+        async with aiohttp.ClientSession(connector=create_connector()) as session:
+            return await test_concurrent_requests(url_base, image_data, num_concurrent, session)
     
-    async with aiohttp.ClientSession() as session:
-        # 创建多个并发任务
-        tasks = []
-        
-        # 混合不同的 API 调用
-        for i in range(num_concurrent):
-            if i % 4 == 0:
-                task = test_yoloe_prompt_free(session, url_base, image_data)
-            elif i % 4 == 1:
-                task = test_moondream_describe(session, url_base, image_data)
-            elif i % 4 == 2:
-                task = test_yoloe_text_prompt(session, url_base, image_data)
-            else:
-                task = test_moondream_answer(session, url_base, image_data)
-            
-            tasks.append(task)
-        
-        # 测量并发执行时间
-        start_time = time.time()
-        results = await asyncio.gather(*tasks)
-        end_time = time.time()
-        
-        print(f"并发执行时间: {end_time - start_time:.2f} 秒")
-        
-        # 检查结果
-        success_count = sum(1 for status, _ in results if status == 200)
-        print(f"成功请求: {success_count}/{num_concurrent}")
+    print(f"\n测试 {num_concurrent} 个并发请求 (并发上限 {MAX_CONCURRENCY})...")
+    
+    sem = asyncio.Semaphore(MAX_CONCURRENCY)
+    # 创建多个并发任务
+    tasks = []
+    
+    # 混合不同的 API 调用
+    for i in range(num_concurrent):
+        if i % 4 == 0:
+            task = test_yoloe_prompt_free(session, url_base, image_data)
+        elif i % 4 == 1:
+            task = test_moondream_describe(session, url_base, image_data)
+        elif i % 4 == 2:
+            task = test_yoloe_text_prompt(session, url_base, image_data)
+        else:
+            task = test_moondream_answer(session, url_base, image_data)
         
-        return results
+        tasks.append(_bounded(sem, task))
+    
+    # 测量并发执行时间
+    start_time = time.time()
+    results = await asyncio.gather(*tasks)
+    end_time = time.time()
+    
+    print(f"并发执行时间: {end_time - start_time:.2f} 秒")
+    
+    # 检查结果
+    success_count = sum(1 for status, _ in results if status == 200)
+    print(f"成功请求: {success_count}/{num_concurrent}")
+    
+    return results
 
 
 async def test_all_endpoints(url_base):
@@ -182,7 +217,7 @@ async def test_all_endpoints(url_base):
     print("创建测试图像...")
     image_data, _ = create_test_image()
     
-    async with aiohttp.ClientSession() as session:
+    async with aiohttp.ClientSession(connector=create_connector()) as session:
         print("\n=== 测试 YOLOe API ===")
         
         # 测试 YOLOe 端点
@@ -244,9 +279,9 @@ async def test_all_endpoints(url_base):
             print(f"✅ 成功！答案: {result['answer'][:50]}...")
         else:
             print(f"❌ 失败！{result}")
-    
-    # 测试并发请求
-    await test_concurrent_requests(url_base, image_data, num_concurrent=10)
+        
+        # 测试并发请求（复用同一个 session）
+        await test_concurrent_requests(url_base, image_data, num_concurrent=10, session=session)
 
 
 async def main():
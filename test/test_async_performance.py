@@ -8,14 +8,64 @@ Date: 2025-05-25
 """
 
 import asyncio
+import functools
 import aiohttp
 import requests
+from requests.adapters import HTTPAdapter
 import time
 from PIL import Image
 import io
 import statistics
 
 
+# 并发请求上限：超过后服务端排队只会拉长尾延迟，吞吐不再提升
+MAX_CONCURRENCY = 8
+
+
+# 同步请求共用的 Session：在各轮测试之间复用 keep-alive 连接，不再每轮重新建连
+SYNC_SESSION = requests.Session()
+SYNC_SESSION.mount("http://", HTTPAdapter(pool_connections=MAX_CONCURRENCY, pool_maxsize=MAX_CONCURRENCY))
+
+
+def create_connector():
+    """创建与并发上限一致的连接池（复用 keep-alive 连接，缓存 DNS 解析）"""
+    return aiohttp.TCPConnector(limit=MAX_CONCURRENCY, ttl_dns_cache=300)
+
+
+# 固定的 multipart 分隔符：相同请求体只需构建一次
+MULTIPART_BOUNDARY = "----EurekAnnoTestBoundary7MA4YWxkTrZu0gW"
+
+
+@functools.lru_cache(maxsize=32)
+def build_multipart(image_data, fields, filename='test.jpg', content_type='image/jpeg'):
+    """
+    构建 multipart/form-data 请求体，返回 (body, Content-Type)
+
+    fields 为 ((名称, 值), ...) 元组。结果会被缓存，重复请求直接复用同一份字节，
+    避免每次请求都重新序列化 FormData。
+    """
+    parts = [
+        f'--{MULTIPART_BOUNDARY}\r\n'
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f'Content-Type: {content_type}\r\n\r\n'.encode() + image_data + b'\r\n'
+    ]
+    for name, value in fields:
+        parts.append(
+            f'--{MULTIPART_BOUNDARY}\r\n'
+            f'Content-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        )
+    parts.append(f'--{MULTIPART_BOUNDARY}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={MULTIPART_BOUNDARY}'
+
+
+async def post_multipart(session, url, image_data, fields):
+    """用预构建的 multipart 请求体发送 POST，返回 (状态码, JSON)"""
+    body, content_type = build_multipart(image_data, tuple(fields.items()))
+    async with session.post(url, data=body, headers={'Content-Type': content_type}) as response:
+        result = await response.json()
+        return response.status, result
+
+
 def create_test_image():
     """创建测试图像"""
     image = Image.new('RGB', (320, 240), color='white')
@@ -26,30 +76,30 @@ def create_test_image():
     draw.rectangle([170, 90, 270, 190], fill='blue', outline='black')
     
     img_bytes = io.BytesIO()
-    image.save(img_bytes, format='PNG')
+    # 基准测试衡量的是服务端处理耗时：限制最长边并用 JPEG 编码，减少编解码与传输开销
+    image.thumbnail((1024, 1024), Image.LANCZOS)
+    image.save(img_bytes, format='JPEG', quality=85, subsampling=2)
     img_bytes.seek(0)
     return img_bytes.getvalue()
 
 
-def sync_request(url, image_data):
-    """同步请求"""
-    files = {'file': ('test.png', image_data, 'image/png')}
+def sync_request(session, url, image_data):
+    """同步请求（复用 requests.Session 的 keep-alive 连接，与 aiohttp 对比才公平）"""
+    files = {'file': ('test.jpg', image_data, 'image/jpeg')}
     data = {'compile': 'false', 'return_image': 'false'}
     
-    response = requests.post(url, files=files, data=data)
+    response = session.post(url, files=files, data=data)
     return response.status_code == 200
 
 
-async def async_request(session, url, image_data):
-    """异步请求"""
-    data = aiohttp.FormData()
-    data.add_field('file', image_data, filename='test.png', content_type='image/png')
-    data.add_field('compile', 'false')
-    data.add_field('return_image', 'false')
+async def async_request(session, url, image_data, sem, extra_fields=None):
+    """异步请求（由信号量限制同时在途的请求数）"""
+    fields = dict(extra_fields or {})
+    fields.update({'compile': 'false', 'return_image': 'false'})
     
-    async with session.post(url, data=data) as response:
-        await response.json()
-        return response.status == 200
+    async with sem:
+        status, _ = await post_multipart(session, url, image_data, fields)
+        return status == 200
 
 
 def test_sync_performance(url, image_data, num_requests=10):
@@ -61,7 +111,7 @@ def test_sync_performance(url, image_data, num_requests=10):
     
     for i in range(num_requests):
         start = time.time()
-        if sync_request(url, image_data):
+        if sync_request(SYNC_SESSION, url, image_data):
             successes += 1
         end = time.time()
         times.append(end - start)
@@ -80,13 +130,14 @@ def test_sync_performance(url, image_data, num_requests=10):
 
 async def test_async_performance(url, image_data, num_requests=10):
     """测试异步性能"""
-    print(f"\n测试异步并发请求 ({num_requests} 个请求)...")
+    print(f"\n测试异步并发请求 ({num_requests} 个请求, 并发上限 {MAX_CONCURRENCY})...")
     
-    async with aiohttp.ClientSession() as session:
+    sem = asyncio.Semaphore(MAX_CONCURRENCY)
+    async with aiohttp.ClientSession(connector=create_connector()) as session:
         start = time.time()
         
         # 创建所有异步任务
-        tasks = [async_request(session, url, image_data) for _ in range(num_requests)]
+        tasks = [async_request(session, url, image_data, sem) for _ in range(num_requests)]
         
         # 并发执行
         results = await asyncio.gather(*tasks)
@@ -153,7 +204,8 @@ async def test_mixed_endpoints():
         ("http://localhost:8001/api/v1/moondream/answer", "Moondream answer"),
     ]
     
-    async with aiohttp.ClientSession() as session:
+    sem = asyncio.Semaphore(MAX_CONCURRENCY)
+    async with aiohttp.ClientSession(connector=create_connector()) as session:
         print("\n发送 20 个混合请求...")
         start = time.time()
         
@@ -161,18 +213,13 @@ async def test_mixed_endpoints():
         for i in range(20):
             url, name = endpoints[i % len(endpoints)]
             
-            data = aiohttp.FormData()
-            data.add_field('file', image_data, filename='test.png', content_type='image/png')
-            
+            extra_fields = {}
             if "ground" in url:
-                data.add_field('object_name', 'rectangle')
+                extra_fields['object_name'] = 'rectangle'
             elif "answer" in url:
-                data.add_field('question', 'What do you see?')
-            
-            data.add_field('compile', 'false')
-            data.add_field('return_image', 'false')
+                extra_fields['question'] = 'What do you see?'
             
-            task = async_request(session, url, image_data)
+            task = async_request(session, url, image_data, sem, extra_fields)
             tasks.append(task)
         
         results = await asyncio.gather(*tasks)
@@ -201,6 +248,8 @@ async def main():
         
     except Exception as e:
         print(f"\n❌ 测试失败: {e}")
+    finally:
+        SYNC_SESSION.close()
 
 
 if __name__ == "__main__":
@@ -3,65 +3,262 @@
 #
 # Usage:
 # python test_yoloe_api.py
+# python test_yoloe_api.py --batch 8   # also send 8 concurrent requests (httpx)
+#
+# Or under pytest, spreading tests over worker processes with pytest-xdist
+# (fixtures are per worker, so each worker gets its own HTTP session). The tests
+# need a running server, so they are skipped unless --run-integration is given:
+# pip install -r test/requirements.txt
+# pytest -n auto --run-integration test/test_yoloe_api.py
 """
 
 import os
 import sys
+import asyncio
+import functools
+import time
 import json
+import mimetypes
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3 import encode_multipart_formdata
 from pathlib import Path
+from urllib.parse import urljoin
 import argparse
-import base64
-from PIL import Image
-import io
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    # SIMD-accelerated drop-in replacement for the stdlib module
+    import pybase64 as base64
+except ImportError:
+    import base64
+
+try:
+    # Faster parsing of large JSON responses (base64 images and masks)
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
+try:
+    import httpx
+except ImportError:  # Only needed for --batch
+    httpx = None
+
+try:
+    import pytest
+except ImportError:  # Running as a plain script
+    pytest = None
+
+# Networked tests are skipped under pytest unless --run-integration is given (see conftest.py)
+integration = pytest.mark.integration if pytest is not None else (lambda func: func)
 
 # Constants
 DEFAULT_API_URL = "http://0.0.0.0:8000/api/v1/yoloe"
 DEFAULT_IMAGE_PATH = "../dataset/examples/boys.jpeg"  # Update with a correct path
 DEFAULT_REFER_PATH = "../dataset/examples/boys.jpeg"  # Using same image for reference test
 
-def test_image_prompt_endpoint(api_url, image_path, refer_path=None, save_output=True):
-    """Test the image-prompt endpoint."""
+# Example bounding boxes (adjust these for your actual image)
+# Format: [x1, y1, x2, y2] for each box
+BBOXES = [[100, 100, 200, 200], [300, 300, 400, 400]]
+CLS = [0, 1]  # Classes 0 and 1 for the two boxes
+
+# Form fields of the image-prompt request, serialized once at import
+IMAGE_PROMPT_FIELDS = (
+    ('bboxes', json.dumps(BBOXES)),
+    ('cls', json.dumps(CLS)),
+    ('return_image', 'true'),
+    ('conf', '0.25'),
+    ('iou', '0.7'),
+    ('retina_masks', 'true'),
+)
+
+# Connection pool size of the shared requests.Session
+SESSION_POOL_SIZE = 32
+
+# Form fields of the prompt-free annotated-image request
+ANNOTATED_FIELDS = (
+    ('conf', '0.25'),
+    ('iou', '0.7'),
+    ('image_format', 'jpeg'),
+)
+
+@functools.lru_cache(maxsize=16)
+def endpoint_url_for(api_url, path):
+    """Join the API base URL and an endpoint path once (tolerates a trailing slash on api_url)."""
+    return urljoin(api_url.rstrip("/") + "/", path)
+
+def create_session():
+    """
+    Create a requests.Session whose connection pool keeps connections alive across calls.
+
+    Retries are disabled so a failing server shows up immediately instead of
+    being masked by retry back-off.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=SESSION_POOL_SIZE, pool_maxsize=SESSION_POOL_SIZE,
+                          max_retries=Retry(total=0, backoff_factor=0))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+if pytest is not None:
+    @pytest.fixture(scope="session")
+    def http_session():
+        session = create_session()
+        yield session
+        session.close()
+
+    @pytest.fixture(scope="session")
+    def api_url():
+        return os.environ.get("YOLOE_API_URL", DEFAULT_API_URL)
+
+    @pytest.fixture(scope="session")
+    def image_path():
+        # Resolved once per session; reading it here also warms the read_upload cache
+        # and reports a missing file at setup rather than inside a test
+        path = Path(os.environ.get("YOLOE_TEST_IMAGE", DEFAULT_IMAGE_PATH)).resolve()
+        read_upload(path)
+        return path
+
+@functools.lru_cache(maxsize=8)
+def read_upload(path):
+    """Read an image file once and return a (filename, bytes, content type) upload tuple."""
+    path = Path(path)
+    content_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+    return path.name, path.read_bytes(), content_type
+
+@functools.lru_cache(maxsize=8)
+def build_multipart(image_path, refer_path, fields):
+    """
+    Build the multipart/form-data body once and return (body, Content-Type).
+
+    fields is a ((name, value), ...) tuple. Repeated requests with the same
+    inputs reuse the cached bytes instead of re-encoding the form every call.
+    """
+    form = dict(fields)
+    form['file'] = read_upload(image_path)
+    if refer_path:
+        form['refer_file'] = read_upload(refer_path)
+    return encode_multipart_formdata(form)
+
+# Worker threads for decoding and saving segmentation masks
+MASK_SAVE_WORKERS = 8
+
+def _save_mask(output_dir, item):
+    """Decode one base64 PNG mask and write it as mask_<i>.png (runs in a worker thread)."""
+    i, mask_b64 = item
+    if mask_b64:
+        # Already PNG-encoded by the server: write the bytes, no decode/re-encode
+        (output_dir / f"mask_{i}.png").write_bytes(base64.b64decode(mask_b64, validate=True))
+
+# Bytes read from the socket per iteration when streaming a response
+STREAM_CHUNK_SIZE = 64 * 1024
+
+def _split_part(part):
+    """Split one multipart part into (name, filename, content)."""
+    head, _, content = part.partition(b'\r\n\r\n')
+    disposition = next(
+        line for line in head.decode().split('\r\n') if line.lower().startswith('content-disposition')
+    )
+    params = dict(
+        item.strip().split('=', 1) for item in disposition.split(';')[1:] if '=' in item
+    )
+    return params['name'].strip('"'), params.get('filename', '').strip('"'), content
+
+def iter_multipart_mixed(response, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Yield the (name, filename, content) parts of a multipart/mixed response as they arrive.
+
+    The server sends the JSON summary as the first part ("results"), then the
+    annotated image and the masks as raw bytes (no base64). The response is
+    read in chunks (request it with stream=True), so only one part is held in
+    memory at a time.
+    """
+    boundary = response.headers['Content-Type'].split('boundary=', 1)[1].strip('"')
+    # Every delimiter after the first is preceded by CRLF; prefix one so the first matches too
+    delimiter = b'\r\n--' + boundary.encode()
+    buffer = bytearray(b'\r\n')
+    chunks = iter(response.iter_content(chunk_size))
+    search_from = 0
+    seen_first = False
+    while True:
+        index = buffer.find(delimiter, search_from)
+        # Need the two bytes after the delimiter ("--" closes the body) before deciding
+        if index < 0 or len(buffer) < index + len(delimiter) + 2:
+            chunk = next(chunks, None)
+            if chunk is None:
+                return
+            search_from = max(0, len(buffer) - len(delimiter)) if index < 0 else index
+            buffer += chunk
+            continue
+        if seen_first:
+            yield _split_part(bytes(buffer[:index]))
+        seen_first = True
+        end = index + len(delimiter)
+        if buffer[end:end + 2] == b'--':
+            return
+        del buffer[:end + 2]
+        search_from = 0
+
+def _save_multipart_outputs(parts):
+    """Write the raw image and mask parts of a multipart/mixed response directly to disk."""
+    output_dir = "test_outputs"
+    mask_dir = os.path.join(output_dir, "masks")
+    os.makedirs(mask_dir, exist_ok=True)
+    num_masks = 0
+    for name, filename, content in parts:
+        if name == "annotated_image":
+            output_path = os.path.join(output_dir, "image_prompt_result" + os.path.splitext(filename)[1])
+            Path(output_path).write_bytes(content)
+            print(f"\nSaved annotated image to: {output_path}")
+        elif name == "segmentation_masks":
+            Path(mask_dir, filename).write_bytes(content)
+            num_masks += 1
+    if num_masks:
+        print(f"Saved {num_masks} segmentation masks to: {mask_dir}")
+
+def run_image_prompt_check(api_url, image_path, http_session, refer_path=None, save_output=True,
+                           accept_multipart=True):
+    """
+    Call the image-prompt endpoint, print the detections and save the outputs.
+
+    With accept_multipart the images and masks are requested as raw
+    multipart/mixed parts; the JSON (base64) response is still handled if the
+    server returns it.
+
+    Returns (status code, parsed "results" or None).
+    """
     print("\n=== Testing YOLOe image-prompt endpoint ===")
     
     # Prepare endpoint URL
-    endpoint_url = f"{api_url}/image-prompt"
+    endpoint_url = endpoint_url_for(api_url, "image-prompt")
     print(f"Endpoint URL: {endpoint_url}")
     
-    # Prepare files and data
-    files = {'file': open(image_path, 'rb')}
-    
-    # Create example bounding boxes (adjust these for your actual image)
-    # Format: [x1, y1, x2, y2] for each box
-    bboxes = [[100, 100, 200, 200], [300, 300, 400, 400]]
-    cls = [0, 1]  # Classes 0 and 1 for the two boxes
-    
-    data = {
-        'bboxes': json.dumps(bboxes),
-        'cls': json.dumps(cls),
-        'return_image': 'true',
-        'conf': '0.25',
-        'iou': '0.7',
-        'retina_masks': 'true'
-    }
-    
     # Add reference image if provided
     if refer_path:
         print(f"Using reference image: {refer_path}")
-        files['refer_file'] = open(refer_path, 'rb')
+    
+    # Prepare the request body (image bytes and form encoding are built once and reused)
+    body, content_type = build_multipart(image_path, refer_path, IMAGE_PROMPT_FIELDS)
     
     # Make the request
     print("Sending request...")
-    response = requests.post(endpoint_url, files=files, data=data)
-    
-    # Close file handles
-    for f in files.values():
-        f.close()
+    headers = {'Content-Type': content_type}
+    if accept_multipart:
+        headers['Accept'] = 'multipart/mixed, application/json;q=0.9'
+    # Stream the body so multipart parts can be written out as they arrive
+    response = http_session.post(endpoint_url, data=body, headers=headers, stream=True)
     
     # Process response
     if response.status_code == 200:
         print("Request successful!")
-        result = response.json()
+        parts = None
+        if response.headers.get('Content-Type', '').startswith('multipart/'):
+            parts = iter_multipart_mixed(response)
+            result = json_loads(next(parts)[2])
+        else:
+            result = json_loads(response.content)
         
         # Print detection results summary
         if "results" in result and "class" in result["results"]:
@@ -74,38 +271,166 @@ def test_image_prompt_endpoint(api_url, image_path, refer_path=None, save_output
         else:
             print("No detections found.")
         
+        if parts is not None:
+            if save_output:
+                _save_multipart_outputs(parts)
+            response.close()
+            return response.status_code, result.get("results")
+        
         # Save the annotated image if available
         if "annotated_image" in result and save_output:
-            image_data = base64.b64decode(result["annotated_image"])
-            image = Image.open(io.BytesIO(image_data))
+            image_data = base64.b64decode(result["annotated_image"], validate=True)
             
             output_dir = "test_outputs"
             os.makedirs(output_dir, exist_ok=True)
             output_path = os.path.join(output_dir, "image_prompt_result.jpg")
             
-            image.save(output_path)
+            # The server already sends an encoded JPEG; write it as is instead of decoding and re-encoding
+            Path(output_path).write_bytes(image_data)
             print(f"\nSaved annotated image to: {output_path}")
             
         # Save segmentation masks if available
         if "segmentation_masks" in result and save_output and result["segmentation_masks"]:
-            output_dir = "test_outputs/masks"
-            os.makedirs(output_dir, exist_ok=True)
+            output_dir = Path("test_outputs/masks")
+            output_dir.mkdir(parents=True, exist_ok=True)
             
-            for i, mask_b64 in enumerate(result["segmentation_masks"]):
-                if mask_b64:
-                    mask_data = base64.b64decode(mask_b64)
-                    mask = Image.open(io.BytesIO(mask_data))
-                    
-                    output_path = os.path.join(output_dir, f"mask_{i}.png")
-                    mask.save(output_path)
+            # Masks are independent; decode and write them in parallel
+            with ThreadPoolExecutor(max_workers=MASK_SAVE_WORKERS) as executor:
+                list(executor.map(functools.partial(_save_mask, output_dir),
+                                  enumerate(result["segmentation_masks"])))
             
             print(f"Saved {len(result['segmentation_masks'])} segmentation masks to: {output_dir}")
         
-        return True
+        return response.status_code, result.get("results")
     else:
         print(f"Request failed with status code {response.status_code}")
         print(f"Error: {response.text}")
-        return False
+        return response.status_code, None
+
+@integration
+def test_image_prompt_endpoint(api_url, image_path, http_session):
+    """Test the image-prompt endpoint returns 200 with a results part."""
+    status_code, results = run_image_prompt_check(api_url, image_path, http_session)
+    assert status_code == 200, f"request failed with status code {status_code}"
+    assert results is not None, "response has no results"
+
+def fetch_prompt_free_annotated(api_url, image_path, http_session, save_output=True):
+    """
+    Call the prompt-free/annotated endpoint, which returns the annotated image as raw JPEG bytes.
+
+    The body is streamed straight to the output file in STREAM_CHUNK_SIZE
+    chunks, so memory stays bounded regardless of the image size.
+
+    Returns (status code, Content-Type).
+    """
+    print("\n=== Testing YOLOe prompt-free/annotated endpoint ===")
+    
+    endpoint_url = endpoint_url_for(api_url, "prompt-free/annotated")
+    print(f"Endpoint URL: {endpoint_url}")
+    
+    body, content_type = build_multipart(image_path, None, ANNOTATED_FIELDS)
+    response = http_session.post(
+        endpoint_url, data=body, headers={'Content-Type': content_type, 'Accept': 'image/jpeg'}, stream=True
+    )
+    try:
+        response_type = response.headers.get('Content-Type', '')
+        if response.status_code != 200:
+            print(f"Request failed with status code {response.status_code}")
+            print(f"Error: {response.text}")
+            return response.status_code, response_type
+        
+        print(f"Request successful! Content-Type: {response_type}")
+        if save_output:
+            output_dir = Path("test_outputs")
+            output_dir.mkdir(parents=True, exist_ok=True)
+            output_path = output_dir / "prompt_free_annotated.jpg"
+            with open(output_path, "wb") as f:
+                for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+                    f.write(chunk)
+            print(f"Saved annotated image to: {output_path}")
+        return response.status_code, response_type
+    finally:
+        response.close()
+
+@integration
+def test_prompt_free_annotated_endpoint(api_url, image_path, http_session, save_output=True):
+    """Test the prompt-free/annotated endpoint returns the annotated image as JPEG."""
+    status_code, response_type = fetch_prompt_free_annotated(api_url, image_path, http_session, save_output)
+    assert status_code == 200, f"request failed with status code {status_code}"
+    assert response_type.startswith("image/jpeg"), f"unexpected Content-Type: {response_type}"
+
+# Connection pool size for concurrent batch requests
+BATCH_MAX_CONNECTIONS = 16
+
+def decode_response_images(result):
+    """Base64-decode the annotated image and masks of a JSON response; returns the byte strings."""
+    decoded = []
+    if result.get("annotated_image"):
+        decoded.append(base64.b64decode(result["annotated_image"], validate=True))
+    decoded.extend(base64.b64decode(mask_b64, validate=True)
+                   for mask_b64 in result.get("segmentation_masks") or [] if mask_b64)
+    return decoded
+
+async def post_image_prompt_async(client, endpoint_url, image_path, refer_path=None):
+    """
+    Send one image-prompt request on an httpx.AsyncClient.
+
+    Returns (status, JSON or error text, decoded image/mask bytes). The base64
+    decoding runs in a worker thread, so it overlaps with the other requests
+    still waiting on the network instead of blocking the event loop.
+    """
+    body, content_type = build_multipart(image_path, refer_path, IMAGE_PROMPT_FIELDS)
+    response = await client.post(
+        endpoint_url, content=body, headers={'Content-Type': content_type, 'Accept': 'application/json'}
+    )
+    if response.status_code != 200:
+        return response.status_code, response.text, []
+    result = json_loads(response.content)
+    return response.status_code, result, await asyncio.to_thread(decode_response_images, result)
+
+async def run_image_prompt_batch(api_url, image_paths, refer_path=None):
+    """
+    Send one image-prompt request per image concurrently over a shared keep-alive pool.
+
+    Returns a list of (status, JSON or error text, decoded image/mask bytes),
+    in the order of image_paths.
+    """
+    if httpx is None:
+        raise RuntimeError("httpx is required for batch requests: pip install httpx")
+    endpoint_url = endpoint_url_for(api_url, "image-prompt")
+    limits = httpx.Limits(max_connections=BATCH_MAX_CONNECTIONS,
+                          max_keepalive_connections=BATCH_MAX_CONNECTIONS)
+    # No client-side timeout, like requests: inference time depends on the server
+    async with httpx.AsyncClient(limits=limits, timeout=None) as client:
+        return await asyncio.gather(
+            *(post_image_prompt_async(client, endpoint_url, path, refer_path) for path in image_paths)
+        )
+
+def run_image_prompt_batch_check(api_url, image_path, num_requests=8):
+    """
+    Send num_requests concurrent image-prompt requests (the same image each time) and print a summary.
+
+    Returns the number of requests that succeeded.
+    """
+    print(f"\n=== Testing {num_requests} concurrent YOLOe image-prompt requests ===")
+    start = time.perf_counter()
+    responses = asyncio.run(run_image_prompt_batch(api_url, [image_path] * num_requests))
+    elapsed = time.perf_counter() - start
+    
+    successes = sum(1 for status, _, _ in responses if status == 200)
+    decoded_bytes = sum(len(data) for _, _, decoded in responses for data in decoded)
+    print(f"Completed {successes}/{num_requests} requests in {elapsed:.2f}s "
+          f"({decoded_bytes} bytes of images and masks decoded)")
+    for status, result, _ in responses:
+        if status != 200:
+            print(f"Request failed with status code {status}: {result}")
+    return successes
+
+@integration
+def test_image_prompt_batch(api_url, image_path, num_requests=8):
+    """Test concurrent image-prompt requests (the same image sent num_requests times)."""
+    successes = run_image_prompt_batch_check(api_url, image_path, num_requests)
+    assert successes == num_requests, f"only {successes}/{num_requests} concurrent requests succeeded"
 
 def main():
     parser = argparse.ArgumentParser(description="Test YOLOe API endpoints")
@@ -113,16 +438,32 @@ def main():
     parser.add_argument("--image", default=DEFAULT_IMAGE_PATH, help="Path to test image")
     parser.add_argument("--refer", default=None, help="Path to reference image (optional)")
     parser.add_argument("--no-save", action="store_true", help="Don't save output images")
+    parser.add_argument("--json-response", action="store_true",
+                        help="Request the JSON (base64) response instead of multipart/mixed")
+    parser.add_argument("--batch", type=int, default=0,
+                        help="Also send this many image-prompt requests concurrently (needs httpx)")
     
     args = parser.parse_args()
     
-    # Test image-prompt endpoint
-    success = test_image_prompt_endpoint(
-        args.api_url, 
-        args.image, 
-        args.refer, 
-        not args.no_save
-    )
+    # Test image-prompt endpoint (one session, reused by every request)
+    with create_session() as session:
+        status_code, results = run_image_prompt_check(
+            args.api_url, 
+            args.image, 
+            session,
+            args.refer, 
+            not args.no_save,
+            not args.json_response
+        )
+        success = status_code == 200 and results is not None
+        
+        status_code, response_type = fetch_prompt_free_annotated(
+            args.api_url, args.image, session, not args.no_save
+        )
+        success = status_code == 200 and response_type.startswith("image/jpeg") and success
+    
+    if args.batch > 0:
+        success = run_image_prompt_batch_check(args.api_url, args.image, args.batch) == args.batch and success
     
     if success:
         print("\nAll tests completed successfully!")